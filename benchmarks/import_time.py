@@ -0,0 +1,59 @@
+"""Import time of the evaluation entry points, and the heavy packages they load.
+
+Run from the repository root:
+
+    python benchmarks/import_time.py
+
+Each module is imported in a fresh interpreter, so nothing is cached between runs.
+The compute-only path (compute_metrics) should not load any plotting or
+statistics package.
+"""
+
+import json
+import subprocess
+import sys
+
+MODULES = [
+    "trialmatch_tool_evaluation.compute_metrics",
+    "trialmatch_tool_evaluation.main",
+    "trialmatch_tool_evaluation.statistical_tests",
+    "trialmatch_tool_evaluation.plot_metrics",
+]
+HEAVY_PACKAGES = [
+    "plotly",
+    "kaleido",
+    "seaborn",
+    "matplotlib",
+    "scipy",
+    "dataframe_image",
+]
+NB_REPEATS = 5
+
+SNIPPET = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+loaded = [name for name in {heavy!r} if name in sys.modules]
+print(json.dumps({{"elapsed": elapsed, "loaded": loaded}}))
+"""
+
+
+def measure(module):
+    code = SNIPPET.format(module=module, heavy=HEAVY_PACKAGES)
+    runs = [
+        json.loads(
+            subprocess.run(
+                [sys.executable, "-c", code], capture_output=True, check=True, text=True
+            ).stdout
+        )
+        for _ in range(NB_REPEATS)
+    ]
+    return min(run["elapsed"] for run in runs), runs[0]["loaded"]
+
+
+if __name__ == "__main__":
+    print(f"{'module':<48}{'import (s)':>12}  heavy packages loaded")
+    for module in MODULES:
+        elapsed, loaded = measure(module)
+        print(f"{module:<48}{elapsed:>12.3f}  {', '.join(loaded) or '-'}")
@@ -0,0 +1,56 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+REPOSITORY = Path(__file__).parent.parent
+FORMATTED_CSV = REPOSITORY / "artifacts" / "data_raw" / "formatted_data.csv"
+NB_PATIENTS = 40
+
+COMPUTE_METRICS = """
+from trialmatch_tool_evaluation import FORMATTED_CSV_PATH
+from trialmatch_tool_evaluation.compute_metrics import main
+from trialmatch_tool_evaluation.preprocess_files import get_formatted_data
+
+main(
+    get_formatted_data(FORMATTED_CSV_PATH),
+    workers={workers},
+    long_table=True,
+    incremental={incremental},
+)
+"""
+
+
+def make_artifact_folder(folder: Path, formatted_data: pd.DataFrame):
+    for name in ["data_raw", "plots", "results"]:
+        (folder / name).mkdir(parents=True, exist_ok=True)
+    formatted_data.to_csv(folder / "data_raw" / "formatted_data.csv", index=False)
+    return folder
+
+
+def run_compute_metrics(folder: Path, workers=1, incremental=False):
+    # A fresh interpreter, as path constants are read from the environment on import
+    subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            COMPUTE_METRICS.format(workers=workers, incremental=incremental),
+        ],
+        cwd=REPOSITORY,
+        env={**os.environ, "ARTIFACT_FOLDER_PATH": str(folder)},
+        check=True,
+        capture_output=True,
+    )
+    return {
+        name: (folder / "results" / name).read_bytes()
+        for name in ["metrics.csv", "aggregation_metrics.csv"]
+    }
+
+
+@pytest.fixture
+def formatted_data():
+    # Raw cells, as in formatted_data.csv
+    return pd.read_csv(FORMATTED_CSV, dtype=str, nrows=NB_PATIENTS)
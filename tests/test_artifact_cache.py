@@ -0,0 +1,25 @@
+import pandas as pd
+
+from trialmatch_tool_evaluation.artifact_cache import artifact_key
+
+
+def test_artifact_key_duplicate_index():
+    # Tables built with pd.concat keep the index of each part
+    table = pd.concat(
+        [pd.DataFrame({"value": [1.0, 2.0]}), pd.DataFrame({"value": [3.0, 4.0]})]
+    )
+    assert table.index.has_duplicates
+    assert artifact_key(table) == artifact_key(table.copy())
+    assert artifact_key(table) != artifact_key(table.iloc[::-1])
+
+
+def test_artifact_key_small_p_values():
+    first = pd.DataFrame({"p_value": [1e-12]})
+    second = pd.DataFrame({"p_value": [2e-12]})
+    assert artifact_key(first) != artifact_key(second)
+
+
+def test_artifact_key_column_labels():
+    first = pd.DataFrame({"precision": [0.5]})
+    second = pd.DataFrame({"recall": [0.5]})
+    assert artifact_key(first) != artifact_key(second)
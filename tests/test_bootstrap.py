@@ -0,0 +1,12 @@
+import numpy as np
+
+from trialmatch_tool_evaluation.bootstrap import jackknife_means
+
+
+def test_jackknife_skips_missing_values():
+    values = np.array([[1.0, 2.0], [3.0, 0.0], [5.0, 4.0]])
+    valid = np.array([[True, True], [True, False], [True, True]])
+    jackknife = jackknife_means(values, valid)
+    np.testing.assert_allclose(jackknife[:, 0], [4.0, 3.0, 2.0])
+    np.testing.assert_allclose(jackknife[[0, 2], 1], [4.0, 2.0])
+    assert np.isnan(jackknife[1, 1])
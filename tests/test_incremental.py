@@ -0,0 +1,16 @@
+from conftest import make_artifact_folder, run_compute_metrics
+
+
+def test_incremental_matches_full_run(tmp_path, formatted_data):
+    folder = make_artifact_folder(tmp_path / "incremental", formatted_data)
+    run_compute_metrics(folder)
+
+    # One changed ranking and one dropped patient
+    changed = formatted_data.copy()
+    changed.loc[3, "Klineo"] = changed.loc[3, "DigitalECMT"]
+    changed = changed.drop(index=5)
+    make_artifact_folder(folder, changed)
+
+    incremental = run_compute_metrics(folder, incremental=True)
+    full = run_compute_metrics(make_artifact_folder(tmp_path / "full", changed))
+    assert incremental == full
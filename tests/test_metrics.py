@@ -0,0 +1,136 @@
+import numpy as np
+import pytest
+
+from trialmatch_tool_evaluation.metrics import (
+    FN,
+    FP,
+    TN,
+    TP,
+    Accuracy,
+    AP_at_k,
+    ErrorRate,
+    FN_at_k,
+    FP_at_k,
+    MetricBatch,
+    NbErrors,
+    NbTrials,
+    NbTrialsWhenNotZero,
+    NDCG_at_k,
+    NFPR_at_k,
+    PercentageOutOfCLBTrials,
+    Precision,
+    Precision_at_k,
+    Sensitivity,
+    Sensitivity_at_k,
+    Specificity,
+    Specificity_at_k,
+    TP_at_k,
+)
+from trialmatch_tool_evaluation.metrics.ranked_metrics import TN_at_k
+from trialmatch_tool_evaluation.ragged import lengths_to_offsets
+
+CORPUS_CARDINALITY = 1000
+K_VALUES = [1, 3, 10, 50]
+
+# (ranking, relevance) per patient: retrieved trials are ranked 1..n, 0 otherwise
+PATIENTS = [
+    # Empty lists
+    ([], []),
+    # Empty ground truth
+    ([1, 2, 0], [0, 0, 0]),
+    # Nothing retrieved
+    ([0, 0], [1, 0]),
+    ([3, 1, 0, 2, 0], [1, 0, 1, 1, 0]),
+    ([1], [1]),
+    ([2, 1, 4, 3], [0, 0, 0, 1]),
+    # Longer than some cut-offs, shorter than others (k > len)
+    (list(range(1, 13)), [1, 0] * 6),
+    ([0, 5, 1, 0, 2, 3, 4], [1, 1, 0, 0, 1, 0, 1]),
+]
+
+
+def make_batch(seed=0):
+    rng = np.random.default_rng(seed)
+    rankings = [ranking for ranking, _ in PATIENTS]
+    lengths = [len(ranking) for ranking in rankings]
+    total = sum(lengths)
+
+    def flat(lists):
+        return np.array([value for values in lists for value in values], dtype=np.int64)
+
+    return MetricBatch(
+        ranking=flat(rankings),
+        relevance=flat(relevance for _, relevance in PATIENTS),
+        offsets=lengths_to_offsets(lengths),
+        nb_all_trials_retrieved=np.array(lengths),
+        specific_relevance=rng.integers(0, 2, total),
+        total_relevance=rng.integers(0, 2, total),
+    )
+
+
+def scalar_scores(metric, batch):
+    scores = [
+        metric.compute(**batch.patient_arguments(i)) for i in range(batch.nb_patients)
+    ]
+    return np.array([np.nan if score is None else score for score in scores])
+
+
+def get_metrics(strategy):
+    metrics = [
+        TP(),
+        FP(),
+        FN(),
+        TN(corpus_cardinality=CORPUS_CARDINALITY),
+        Precision(strategy=strategy),
+        Sensitivity(strategy=strategy),
+        Specificity(corpus_cardinality=CORPUS_CARDINALITY),
+        Accuracy(),
+        NbTrials(),
+        NbTrialsWhenNotZero(),
+        NbErrors(),
+        ErrorRate(strategy=strategy),
+    ]
+    for k in K_VALUES:
+        metrics += [
+            TP_at_k(k=k),
+            FP_at_k(k=k),
+            FN_at_k(k=k),
+            TN_at_k(k=k, corpus_cardinality=CORPUS_CARDINALITY),
+            Precision_at_k(k=k, strategy=strategy),
+            Sensitivity_at_k(k=k, strategy=strategy),
+            Specificity_at_k(k=k, corpus_cardinality=CORPUS_CARDINALITY),
+            AP_at_k(k=k, strategy=strategy),
+            NDCG_at_k(k=k, strategy=strategy),
+            NFPR_at_k(k=k, strategy=strategy),
+        ]
+    return metrics
+
+
+@pytest.mark.parametrize("strategy", [None, 0])
+def test_compute_batch_matches_compute(strategy):
+    batch = make_batch()
+    for metric in get_metrics(strategy):
+        np.testing.assert_array_equal(
+            metric.compute_batch(batch),
+            scalar_scores(metric, batch),
+            err_msg=f"{type(metric).__name__} {metric.name}",
+        )
+
+
+def test_percentage_out_of_clb_trials():
+    batch = make_batch()
+    nct_ids = np.array([f"NCT{i:08d}" for i in range(len(batch.ranking))])
+    clb_nct_ids = nct_ids[::3]
+    in_clb = np.isin(nct_ids, clb_nct_ids)
+
+    metric = PercentageOutOfCLBTrials()
+    expected = [
+        metric.compute(
+            batch.ranking[start:stop].tolist(),
+            batch.relevance[start:stop].tolist(),
+            nct_ids[start:stop],
+            clb_nct_ids,
+        )
+        for start, stop in zip(batch.offsets[:-1], batch.offsets[1:])
+    ]
+    np.testing.assert_array_equal(metric.compute_batch(batch, in_clb), expected)
@@ -0,0 +1,11 @@
+from conftest import make_artifact_folder, run_compute_metrics
+
+
+def test_sharded_run_matches_serial_run(tmp_path, formatted_data):
+    serial = run_compute_metrics(
+        make_artifact_folder(tmp_path / "serial", formatted_data), workers=1
+    )
+    sharded = run_compute_metrics(
+        make_artifact_folder(tmp_path / "sharded", formatted_data), workers=2
+    )
+    assert serial == sharded
@@ -12,5 +12,14 @@ RESULTS_FOLDER = ARTIFACT_FOLDER / "results"
 CLB_CLINICAL_TRIALS_PATH = DATA_RAW_FOLDER / "clb_clinical_trials.csv"
 
 METRICS_PATH = RESULTS_FOLDER / "metrics.csv"
+METRICS_STATE_PATH = RESULTS_FOLDER / "metrics_state.csv"
+METRICS_STORE_PATH = RESULTS_FOLDER / "metrics.npz"
 AGGREGATION_METRICS_PATH = RESULTS_FOLDER / "aggregation_metrics.csv"
+METRIC_CURVES_PATH = RESULTS_FOLDER / "metric_curves.csv"
+STRATIFIED_METRICS_PATH = RESULTS_FOLDER / "stratified_metrics.csv"
+ALTERATION_COOCCURRENCE_PATH = RESULTS_FOLDER / "alteration_cooccurrence.csv"
+EXCLUSION_CRITERIA_PATH = RESULTS_FOLDER / "exclusion_criteria.csv"
+FALSE_POSITIVES_PATH = RESULTS_FOLDER / "false_positives.csv"
+DIFF_FROM_MEDIAN_PATH = RESULTS_FOLDER / "diff_from_median.csv"
+ARTIFACT_MANIFEST_PATH = RESULTS_FOLDER / "artifact_manifest.json"
 FORMATTED_CSV_PATH = DATA_RAW_FOLDER / "formatted_data.csv"
@@ -1,18 +1,15 @@
-import dataframe_image as dfi
+import numpy as np
 import pandas as pd
 
-from trialmatch_tool_evaluation import (
-    AGGREGATION_METRICS_PATH,
-    CLB_CLINICAL_TRIALS_PATH,
-    METRICS_PATH,
+from trialmatch_tool_evaluation import AGGREGATION_METRICS_PATH, METRICS_PATH
+from trialmatch_tool_evaluation.artifact_cache import (
+    artifact_key,
+    is_cached,
+    record_artifact,
 )
 from trialmatch_tool_evaluation.metrics.base_metrics import Metric
 
 
-def get_clb_clinical_trials_file():
-    return pd.read_csv(CLB_CLINICAL_TRIALS_PATH, sep=";")
-
-
 def get_metrics():
     return pd.read_csv(METRICS_PATH)
 
@@ -34,12 +31,36 @@ def append_metrics_dict(
         metrics_dict["criterium"].append(criterium)
 
 
+def extend_metrics_dict(
+    metrics_dict, metrics, scores, criterium=None, tool=None, patient_ids=None
+):
+    # scores holds one row per patient and one column per metric
+    nb_patients, nb_metrics = scores.shape
+    metrics_dict["metric_name"].extend(
+        [metric.name for metric in metrics] * nb_patients
+    )
+    metrics_dict["value"].extend(scores.ravel().tolist())
+    metrics_dict["patient_id"].extend(np.repeat(patient_ids, nb_metrics).tolist())
+
+    if tool:
+        metrics_dict["tool"].extend([tool] * scores.size)
+    if criterium:
+        metrics_dict["criterium"].extend([criterium] * scores.size)
+
+
 def dfi_export_proxy(obj, filename):
+    key = artifact_key(obj)
+    if is_cached(filename, key):
+        return
+
+    import dataframe_image as dfi
+
     dfi.export(
         obj=obj,
         filename=filename,
         table_conversion="matplotlib",
     )
+    record_artifact(filename, key)
 
 
 def union_binary(list1, list2):
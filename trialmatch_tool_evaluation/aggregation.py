@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+
+STATISTICS = ["mean", "median", "std", "count"]
+
+
+def aggregate_rows(scores):
+    # One group over every row, so pandas runs the same grouped kernels (Kahan
+    # mean, Welford std, exact median) in the same row order as a groupby over
+    # the long table
+    statistics = (
+        pd.DataFrame(scores).groupby(np.zeros(len(scores), dtype=int)).agg(STATISTICS)
+    )
+    return {
+        name: statistics.xs(name, axis=1, level=1).to_numpy()[0] for name in STATISTICS
+    }
+
+
+class MetricAggregator:
+    # Scores are written at their patient positions, in whatever order shards
+    # complete, and reduced in canonical patient order, so the statistics do not
+    # depend on the number of workers. Medians stay exact, as in the groupby this
+    # replaces, which needs every score: memory grows with groups x patients x
+    # metrics floats, while the long table and its string keys are only built on
+    # request
+    def __init__(self, metric_names, groups, nb_patients):
+        self.metric_names = list(metric_names)
+        # (criterium, tool) -> scores, one row per patient and one column per metric,
+        # in the order of groups
+        self.scores = {
+            group: np.empty((nb_patients, len(self.metric_names))) for group in groups
+        }
+
+    def update(self, criterium, tool, scores, patients=slice(None)):
+        self.scores[(criterium, tool)][patients] = scores
+
+    def _frame(self, statistics, by):
+        return (
+            pd.concat(
+                [
+                    pd.DataFrame(
+                        {
+                            "metric_name": self.metric_names,
+                            "criterium": criterium,
+                            "tool": tool,
+                            **group_statistics,
+                        }
+                    )
+                    for (criterium, tool), group_statistics in statistics.items()
+                ]
+            )
+            .sort_values(by, kind="stable")
+            .reset_index(drop=True)
+        )
+
+    def to_frame(self):
+        tool_statistics = {
+            key: aggregate_rows(scores) for key, scores in self.scores.items()
+        }
+        # The "all" rollup sees the scores tool after tool, as in the long table
+        criteria = dict.fromkeys(criterium for criterium, _ in self.scores)
+        rollup_statistics = {
+            (criterium, "all"): aggregate_rows(
+                np.concatenate(
+                    [
+                        scores
+                        for (group_criterium, _), scores in self.scores.items()
+                        if group_criterium == criterium
+                    ]
+                )
+            )
+            for criterium in criteria
+        }
+        return pd.concat(
+            [
+                self._frame(tool_statistics, ["metric_name", "criterium", "tool"]),
+                self._frame(rollup_statistics, ["metric_name", "criterium"]),
+            ]
+        )
@@ -0,0 +1,123 @@
+import atexit
+import hashlib
+import json
+import os
+from contextlib import contextmanager
+from functools import cache
+from importlib.metadata import PackageNotFoundError, version
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from trialmatch_tool_evaluation import ARTIFACT_FOLDER, ARTIFACT_MANIFEST_PATH
+
+# Bump when a plot or table changes without its inputs changing (layout, styling)
+RENDERER_VERSION = 1
+RENDERER_PACKAGES = ["plotly", "kaleido", "matplotlib", "seaborn", "dataframe-image"]
+
+# Manifest mapping each artifact path to the key it was last rendered from
+_manifest = None
+# Whether _manifest has entries that are not written yet
+_manifest_changed = False
+# Entries recorded while a collect_records block is active, written by the caller
+_records = None
+
+
+@cache
+def get_renderer_signature():
+    package_versions = {}
+    for package in RENDERER_PACKAGES:
+        try:
+            package_versions[package] = version(package)
+        except PackageNotFoundError:
+            package_versions[package] = None
+    return {"renderer_version": RENDERER_VERSION} | package_versions
+
+
+def _serialize(value):
+    # DataFrames are hashed row by row at full precision, duplicate index included
+    if isinstance(value, pd.DataFrame):
+        labels = (list(value.columns), list(map(str, value.dtypes)), value.index.names)
+        rows = pd.util.hash_pandas_object(value, index=True).to_numpy()
+        return repr(labels).encode() + rows.tobytes()
+    # Figures serialize to JSON including layout and styling
+    if hasattr(value, "to_json"):
+        return value.to_json().encode()
+    if isinstance(value, np.ndarray):
+        return repr((value.dtype.str, value.shape)).encode() + value.tobytes()
+    return repr(value).encode()
+
+
+def artifact_key(*inputs):
+    key = hashlib.sha256(repr(get_renderer_signature()).encode())
+    for value in inputs:
+        key.update(_serialize(value))
+    return key.hexdigest()
+
+
+def _get_manifest():
+    global _manifest
+    if _manifest is None:
+        if ARTIFACT_MANIFEST_PATH.exists():
+            _manifest = json.loads(ARTIFACT_MANIFEST_PATH.read_text())
+        else:
+            _manifest = {}
+    return _manifest
+
+
+def _manifest_entry(path):
+    path = Path(path).resolve()
+    try:
+        return str(path.relative_to(ARTIFACT_FOLDER.resolve()))
+    except ValueError:
+        return str(path)
+
+
+def is_cached(path, key):
+    return Path(path).exists() and _get_manifest().get(_manifest_entry(path)) == key
+
+
+def _write_manifest(manifest):
+    # Written through a temporary file so concurrent readers never see a partial file
+    ARTIFACT_MANIFEST_PATH.parent.mkdir(parents=True, exist_ok=True)
+    temporary_path = ARTIFACT_MANIFEST_PATH.with_suffix(f".{os.getpid()}.tmp")
+    temporary_path.write_text(json.dumps(manifest, indent=2, sort_keys=True))
+    os.replace(temporary_path, ARTIFACT_MANIFEST_PATH)
+
+
+def save_manifest():
+    global _manifest_changed
+    if _manifest_changed:
+        _write_manifest(_manifest)
+        _manifest_changed = False
+
+
+# Modules run on their own have no end of run, their entries are written at exit
+atexit.register(save_manifest)
+
+
+def update_manifest(records):
+    # Kept in memory, the manifest is written once by save_manifest at the end of
+    # the run
+    global _manifest_changed
+    _get_manifest().update(records)
+    if _records is None:
+        _manifest_changed = True
+    else:
+        _records.update(records)
+
+
+def record_artifact(path, key):
+    update_manifest({_manifest_entry(path): key})
+
+
+@contextmanager
+def collect_records():
+    # Used in stage processes, which hand their entries back to the parent process
+    global _records
+    previous, _records = _records, {}
+    try:
+        yield _records
+    finally:
+        _records = previous
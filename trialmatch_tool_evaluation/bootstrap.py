@@ -0,0 +1,160 @@
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import numpy as np
+import pandas as pd
+from scipy.special import ndtr, ndtri
+
+from trialmatch_tool_evaluation import METRICS_STORE_PATH, RESULTS_FOLDER
+from trialmatch_tool_evaluation.constants import (
+    CONFIDENCE_LEVEL,
+    NB_RESAMPLES,
+    RANDOM_SEED,
+)
+from trialmatch_tool_evaluation.metrics.batch import divide
+from trialmatch_tool_evaluation.metrics_store import MetricsStore
+from trialmatch_tool_evaluation.paired import paired_differences
+
+BOOTSTRAP_MEANS_PATH = RESULTS_FOLDER / "bootstrap_means.csv"
+BOOTSTRAP_DIFFERENCES_PATH = RESULTS_FOLDER / "bootstrap_differences.csv"
+RESAMPLES_PER_CHUNK = 1000
+# Chunks are also capped to about this many (resample, patient) cells
+RESAMPLED_CELLS_PER_CHUNK = 2**22
+
+
+def resample_counts(nb_patients, nb_resamples, seed):
+    # How many times each patient is drawn in each resample (resamples x patients)
+    rng = np.random.default_rng(seed)
+    uniform = np.full(nb_patients, 1 / nb_patients)
+    return rng.multinomial(nb_patients, uniform, size=nb_resamples).astype(float)
+
+
+def resampled_means(seed, nb_resamples, values, valid):
+    # Mean of the non-missing values of every column, for each resample at once
+    counts = resample_counts(len(values), nb_resamples, seed)
+    return divide(counts @ values, counts @ valid)
+
+
+def bootstrap_means(values, valid, nb_resamples, seed, workers=1):
+    # Resamples are drawn in fixed-size chunks, each with its own child seed, so
+    # the result does not depend on the number of workers
+    chunk_size = min(
+        RESAMPLES_PER_CHUNK, max(1, RESAMPLED_CELLS_PER_CHUNK // max(len(values), 1))
+    )
+    chunk_sizes = [chunk_size] * (nb_resamples // chunk_size)
+    if nb_resamples % chunk_size:
+        chunk_sizes.append(nb_resamples % chunk_size)
+    seeds = np.random.SeedSequence(seed).spawn(len(chunk_sizes))
+
+    compute_chunk = partial(resampled_means, values=values, valid=valid)
+    if workers <= 1:
+        chunks = list(map(compute_chunk, seeds, chunk_sizes))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            chunks = list(executor.map(compute_chunk, seeds, chunk_sizes))
+    return np.concatenate(chunks)
+
+
+def jackknife_means(values, valid):
+    # Leave-one-patient-out means (patients x columns), NaN for patients without a
+    # value in the column, whose removal would only repeat the full estimate
+    means = divide(values.sum(axis=0) - values, valid.sum(axis=0) - valid)
+    return np.where(valid, means, np.nan)
+
+
+def column_quantiles(sorted_samples, nb_samples, probabilities):
+    # Linear interpolation, as numpy's default quantile, with one probability per
+    # column; missing samples are sorted last and excluded through nb_samples
+    position = probabilities * (nb_samples - 1)
+    position = np.where(np.isfinite(position), position, 0)
+    lower = np.clip(np.floor(position).astype(int), 0, len(sorted_samples) - 1)
+    upper = np.clip(lower + 1, 0, np.maximum(nb_samples - 1, 0))
+    lower_values = np.take_along_axis(sorted_samples, lower[None, :], axis=0)[0]
+    upper_values = np.take_along_axis(sorted_samples, upper[None, :], axis=0)[0]
+    quantiles = lower_values + (upper_values - lower_values) * (position - lower)
+
+    undefined = (nb_samples == 0) | ~np.isfinite(probabilities)
+    return np.where(undefined, np.nan, quantiles)
+
+
+def confidence_intervals(values, valid, bootstrap, confidence_level):
+    estimate = divide(values.sum(axis=0), valid.sum(axis=0))
+    sorted_bootstrap = np.sort(bootstrap, axis=0)
+    nb_samples = (~np.isnan(bootstrap)).sum(axis=0)
+    alphas = np.array([(1 - confidence_level) / 2, (1 + confidence_level) / 2])
+
+    # Bias correction from the share of resamples below the estimate
+    below = (bootstrap < estimate).sum(axis=0) + (bootstrap <= estimate).sum(axis=0)
+    z0 = ndtri(divide(below, 2 * nb_samples))
+
+    # Acceleration from the jackknife skewness, over the patients with a value
+    jackknife = jackknife_means(values, valid)
+    jackknife_mean = divide(
+        np.nansum(jackknife, axis=0), (~np.isnan(jackknife)).sum(axis=0)
+    )
+    deviations = jackknife_mean - jackknife
+    with np.errstate(divide="ignore", invalid="ignore"):
+        acceleration = np.nansum(deviations**3, axis=0) / (
+            6 * np.nansum(deviations**2, axis=0) ** 1.5
+        )
+
+    z = z0 + ndtri(alphas)[:, None]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        bca_alphas = ndtr(z0 + z / (1 - acceleration * z))
+
+    percentile = [
+        column_quantiles(sorted_bootstrap, nb_samples, np.full(len(estimate), alpha))
+        for alpha in alphas
+    ]
+    bca = [
+        column_quantiles(sorted_bootstrap, nb_samples, bca_alpha)
+        for bca_alpha in bca_alphas
+    ]
+    return {
+        "mean": estimate,
+        "percentile_inf": percentile[0],
+        "percentile_sup": percentile[1],
+        "bca_inf": bca[0],
+        "bca_sup": bca[1],
+    }
+
+
+def main(
+    df_metrics: pd.DataFrame,
+    nb_resamples: int = NB_RESAMPLES,
+    confidence_level: float = CONFIDENCE_LEVEL,
+    seed: int = RANDOM_SEED,
+    workers: int = 1,
+):
+
+    # ------------------------------ Bootstrap means and paired differences ------------------------------
+
+    values, keys = MetricsStore.from_frame(df_metrics).matrix()
+    differences, difference_keys = paired_differences(values, keys)
+
+    # Means and differences share the same resampled patients
+    samples = np.column_stack([values, differences])
+    valid = ~np.isnan(samples)
+    samples = np.where(valid, samples, 0.0)
+    bootstrap = bootstrap_means(samples, valid, nb_resamples, seed, workers)
+    intervals = confidence_intervals(samples, valid, bootstrap, confidence_level)
+
+    # ---------------------------------------- Save intervals ----------------------------------------
+
+    nb_means = len(keys)
+    df_means = pd.DataFrame(keys, columns=["metric", "criterium", "tool"]).assign(
+        **{name: interval[:nb_means] for name, interval in intervals.items()}
+    )
+    df_differences = pd.DataFrame(
+        difference_keys, columns=["metric", "criterium", "tool_1", "tool_2"]
+    ).assign(**{name: interval[nb_means:] for name, interval in intervals.items()})
+
+    df_means.to_csv(BOOTSTRAP_MEANS_PATH, index=False)
+    df_differences.to_csv(BOOTSTRAP_DIFFERENCES_PATH, index=False)
+
+    return df_means, df_differences
+
+
+if __name__ == "__main__":
+    df_metrics = MetricsStore.load(METRICS_STORE_PATH).to_frame()
+    main(df_metrics)
@@ -0,0 +1,42 @@
+from dataclasses import dataclass
+from functools import cache
+
+import numpy as np
+import pandas as pd
+
+from trialmatch_tool_evaluation import CLB_CLINICAL_TRIALS_PATH
+from trialmatch_tool_evaluation.trial_dictionary import TrialDictionary
+
+OPEN_TO_INCLUSIONS = "Ouverte aux inclusions"
+
+
+@dataclass(frozen=True)
+class CLBTrialRegistry:
+    # Hashed NCT IDs of every CLB trial and of the ones open to inclusions
+    any_nct_ids: pd.Index
+    open_nct_ids: pd.Index
+
+    @staticmethod
+    def from_file(path=CLB_CLINICAL_TRIALS_PATH):
+        trials = pd.read_csv(
+            path, sep=";", usecols=["VALEUR", "STATUT_RECRUTEMENT"], dtype=str
+        )
+        trials = trials[trials["VALEUR"].str.contains("NCT", na=False)]
+        is_open = trials["STATUT_RECRUTEMENT"] == OPEN_TO_INCLUSIONS
+        return CLBTrialRegistry(
+            any_nct_ids=pd.Index(trials["VALEUR"].unique()),
+            open_nct_ids=pd.Index(trials.loc[is_open, "VALEUR"].unique()),
+        )
+
+    def nct_ids(self, criterium):
+        # Eligibility does not depend on the recruitment status, the other criteria do
+        return self.any_nct_ids if criterium == "eligibility" else self.open_nct_ids
+
+    def mask(self, trials: TrialDictionary, criterium) -> np.ndarray:
+        # Bitset over the codes of trials, indexed by Cohort.nct_code
+        return trials.mask(self.nct_ids(criterium))
+
+
+@cache
+def get_clb_trial_registry():
+    return CLBTrialRegistry.from_file()
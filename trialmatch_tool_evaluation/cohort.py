@@ -0,0 +1,196 @@
+from dataclasses import dataclass
+from functools import cached_property
+from itertools import chain
+
+import numpy as np
+import pandas as pd
+
+from trialmatch_tool_evaluation.constants import CRITERIA, TrialMatchingTools
+from trialmatch_tool_evaluation.ragged import (
+    lengths_to_offsets,
+    segment_ids,
+    segment_max,
+    segment_sum,
+)
+from trialmatch_tool_evaluation.trial_dictionary import TrialDictionary
+
+RELEVANCE_COLUMNS = ["eligibility", "status", "eligibility_and_status"]
+EXCLUSION_COLUMNS = ["exclusion_category_1", "exclusion_category_2"]
+
+
+def _flatten(cells, dtype, total):
+    return np.fromiter(chain.from_iterable(cells), dtype=dtype, count=total)
+
+
+def _encode_exclusion_categories(formatted_data, offsets):
+    cells = {column: formatted_data[column].tolist() for column in EXCLUSION_COLUMNS}
+    codes, categories = pd.factorize(
+        pd.Series(
+            [
+                category
+                for column in EXCLUSION_COLUMNS
+                for c in cells[column]
+                for category in c
+            ],
+            dtype=object,
+        )
+    )
+
+    encoded = {}
+    start = 0
+    for column in EXCLUSION_COLUMNS:
+        cell_offsets = lengths_to_offsets([len(c) for c in cells[column]])
+        column_codes = codes[start : start + cell_offsets[-1]]
+        start += cell_offsets[-1]
+
+        patients = segment_ids(cell_offsets)
+        positions = np.arange(len(column_codes)) - cell_offsets[patients]
+        kept = positions < np.diff(offsets)[patients]
+        # Exclusion lists are padded with None beyond the retrieved trials
+        if (column_codes[~kept] != -1).any():
+            raise ValueError(f"{column} has categories beyond the retrieved trials.")
+
+        encoded[column] = np.full(offsets[-1], -1, dtype=np.int32)
+        encoded[column][offsets[patients[kept]] + positions[kept]] = column_codes[kept]
+
+    return encoded, np.asarray(categories, dtype=str)
+
+
+@dataclass
+class Cohort:
+    patient_id: np.ndarray
+    tumor_type: np.ndarray
+    genes: np.ndarray
+    offsets: np.ndarray
+    nct_code: np.ndarray
+    trials: TrialDictionary
+    rankings: dict
+    eligibility: np.ndarray
+    status: np.ndarray
+    eligibility_and_status: np.ndarray
+    exclusion_category_1: np.ndarray
+    exclusion_category_2: np.ndarray
+    exclusion_categories: np.ndarray
+
+    @staticmethod
+    def from_formatted_data(formatted_data: pd.DataFrame):
+        lengths = formatted_data["nct_id"].apply(len).to_numpy()
+        total = int(lengths.sum())
+
+        for column in TrialMatchingTools.all() + RELEVANCE_COLUMNS:
+            if not (formatted_data[column].apply(len).to_numpy() == lengths).all():
+                raise ValueError(f"{column} is not aligned with nct_id.")
+
+        exclusion_codes, exclusion_categories = _encode_exclusion_categories(
+            formatted_data, lengths_to_offsets(lengths)
+        )
+        trials, nct_code = TrialDictionary.from_nct_ids(
+            list(chain.from_iterable(formatted_data["nct_id"]))
+        )
+
+        return Cohort(
+            patient_id=formatted_data["patient_id"].to_numpy(),
+            tumor_type=formatted_data["tumor_type"].to_numpy(),
+            genes=formatted_data["genes"].to_numpy(dtype=object),
+            offsets=lengths_to_offsets(lengths),
+            nct_code=nct_code,
+            trials=trials,
+            rankings={
+                tool: _flatten(formatted_data[tool], np.int32, total)
+                for tool in TrialMatchingTools.all()
+            },
+            eligibility=_flatten(formatted_data["eligibility"], np.int8, total),
+            status=_flatten(formatted_data["status"], np.int8, total),
+            eligibility_and_status=_flatten(
+                formatted_data["eligibility_and_status"], np.int8, total
+            ),
+            exclusion_category_1=exclusion_codes["exclusion_category_1"],
+            exclusion_category_2=exclusion_codes["exclusion_category_2"],
+            exclusion_categories=exclusion_categories,
+        )
+
+    @property
+    def nb_patients(self):
+        return len(self.patient_id)
+
+    @property
+    def nb_pairs(self):
+        return int(self.offsets[-1])
+
+    @cached_property
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    @cached_property
+    def segment_ids(self):
+        return segment_ids(self.offsets)
+
+    @cached_property
+    def nct_id(self):
+        return self.trials.decode(self.nct_code)
+
+    def unique_trials(self):
+        return np.unique(self.nct_code)
+
+    def relevance(self, criterium):
+        if criterium not in CRITERIA:
+            raise ValueError("Unknown criteria.")
+        return getattr(self, criterium)
+
+    def patient_slice(self, i):
+        return slice(self.offsets[i], self.offsets[i + 1])
+
+    def patient_view(self, i):
+        pairs = self.patient_slice(i)
+        return {
+            "patient_id": self.patient_id[i],
+            "nct_id": self.nct_id[pairs],
+            **{tool: ranking[pairs] for tool, ranking in self.rankings.items()},
+            **{column: getattr(self, column)[pairs] for column in RELEVANCE_COLUMNS},
+            **{column: getattr(self, column)[pairs] for column in EXCLUSION_COLUMNS},
+        }
+
+    def segment_sum(self, values):
+        return segment_sum(values, self.offsets)
+
+    def segment_max(self, values, initial=0):
+        return segment_max(values, self.offsets, initial=initial)
+
+    def take(self, patients):
+        if isinstance(patients, slice):
+            start, stop, _ = patients.indices(self.nb_patients)
+            pairs = slice(self.offsets[start], self.offsets[stop])
+            offsets = self.offsets[start : stop + 1] - self.offsets[start]
+        else:
+            patients = np.asarray(patients)
+            lengths = self.lengths[patients]
+            offsets = lengths_to_offsets(lengths)
+            pairs = np.repeat(self.offsets[:-1][patients] - offsets[:-1], lengths)
+            pairs += np.arange(offsets[-1])
+
+        return Cohort(
+            patient_id=self.patient_id[patients],
+            tumor_type=self.tumor_type[patients],
+            genes=self.genes[patients],
+            offsets=offsets,
+            nct_code=self.nct_code[pairs],
+            trials=self.trials,
+            rankings={tool: ranking[pairs] for tool, ranking in self.rankings.items()},
+            eligibility=self.eligibility[pairs],
+            status=self.status[pairs],
+            eligibility_and_status=self.eligibility_and_status[pairs],
+            exclusion_category_1=self.exclusion_category_1[pairs],
+            exclusion_category_2=self.exclusion_category_2[pairs],
+            exclusion_categories=self.exclusion_categories,
+        )
+
+    def shard_slices(self, nb_shards):
+        bounds = np.linspace(0, self.nb_patients, nb_shards + 1).astype(int)
+        return [
+            slice(start, stop)
+            for start, stop in zip(bounds[:-1], bounds[1:])
+            if stop > start
+        ]
+
+    def split(self, nb_shards):
+        return [self.take(patients) for patients in self.shard_slices(nb_shards)]
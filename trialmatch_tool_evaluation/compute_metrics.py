@@ -1,19 +1,18 @@
 from typing import List
 
+import numpy as np
 import pandas as pd
 
 from trialmatch_tool_evaluation import (
     AGGREGATION_METRICS_PATH,
     FORMATTED_CSV_PATH,
     METRICS_PATH,
+    METRICS_STORE_PATH,
     PLOTS_FOLDER,
 )
-from trialmatch_tool_evaluation._utils import (
-    append_metrics_dict,
-    dfi_export_proxy,
-    intersect_binary,
-    union_binary,
-)
+from trialmatch_tool_evaluation._utils import dfi_export_proxy
+from trialmatch_tool_evaluation.aggregation import MetricAggregator
+from trialmatch_tool_evaluation.cohort import Cohort
 from trialmatch_tool_evaluation.constants import (
     CORPUS_CARDINALITY,
     CRITERIA,
@@ -21,6 +20,11 @@ from trialmatch_tool_evaluation.constants import (
     STRATEGY,
     TrialMatchingTools,
 )
+from trialmatch_tool_evaluation.incremental import (
+    get_row_hashes,
+    read_previous_scores,
+    write_metrics_state,
+)
 from trialmatch_tool_evaluation.metrics import (
     FN,
     FP,
@@ -29,6 +33,7 @@ from trialmatch_tool_evaluation.metrics import (
     Accuracy,
     AP_at_k,
     ErrorRate,
+    MetricBatch,
     NDCG_at_k,
     NFPR_at_k,
     Precision,
@@ -36,42 +41,42 @@ from trialmatch_tool_evaluation.metrics import (
     Specificity,
 )
 from trialmatch_tool_evaluation.metrics.base_metrics import Metric, RankedMetric
+from trialmatch_tool_evaluation.metrics_store import MetricsStore
+from trialmatch_tool_evaluation.parallel import imap_shards
 from trialmatch_tool_evaluation.preprocess_files import get_formatted_data
+from trialmatch_tool_evaluation.relevance_index import RelevanceIndex
 
 
-def calculate_total_specific_relevance(df_relevance, criterium, patient_id):
-    total_relevance = intersect_binary(
-        df_relevance[df_relevance["patient_id"] == patient_id]["eligibility"].iloc[0],
-        df_relevance[df_relevance["patient_id"] == patient_id]["status"].iloc[0],
-    )
-    if criterium == "eligibility_and_status":
-        specific_relevance = union_binary(
-            df_relevance[df_relevance["patient_id"] == patient_id]["eligibility"].iloc[
-                0
-            ],
-            df_relevance[df_relevance["patient_id"] == patient_id]["status"].iloc[0],
-        )
-    else:
-        specific_relevance = df_relevance[df_relevance["patient_id"] == patient_id][
-            criterium
-        ].iloc[0]
-
-    return total_relevance, specific_relevance
+def compute_scores(cohort: Cohort, metrics: List[Metric]):
+    relevance_index = RelevanceIndex.from_cohort(cohort)
 
-
-def main(formatted_data: pd.DataFrame):
+    scores = {}
+    for criterium in CRITERIA:
+        for tool in TrialMatchingTools.all():
+            batch = MetricBatch(
+                ranking=cohort.rankings[tool],
+                relevance=cohort.relevance(criterium),
+                offsets=cohort.offsets,
+                nb_all_trials_retrieved=cohort.lengths,
+                specific_relevance=relevance_index.specific_relevance(criterium),
+                total_relevance=relevance_index.total_relevance(),
+            )
+            scores[(criterium, tool)] = np.column_stack(
+                [metric.compute_batch(batch) for metric in metrics]
+            )
+
+    return scores
+
+
+def main(
+    formatted_data: pd.DataFrame,
+    workers: int = 1,
+    long_table: bool = False,
+    incremental: bool = False,
+):
 
     # -------------------------------------- Compute aggregation metrics --------------------------------------
 
-    # Initialize metrics dictionary
-    metrics = {
-        "metric_name": [],
-        "criterium": [],
-        "tool": [],
-        "patient_id": [],
-        "value": [],
-    }
-
     unranked_metrics: List[Metric] = [
         TP(),
         FP(),
@@ -92,63 +97,58 @@ def main(formatted_data: pd.DataFrame):
             NFPR_at_k(k=k, strategy=STRATEGY),
         ]
     ]
-    trials_retrieved_count_by_patient = {
-        patient_id: len(nct_ids)
-        for patient_id, nct_ids in zip(
-            formatted_data["patient_id"], formatted_data["nct_id"]
+    all_metrics = unranked_metrics + ranked_metrics
+    metric_names = [metric.name for metric in all_metrics]
+    cohort = Cohort.from_formatted_data(formatted_data)
+    row_hashes = get_row_hashes(
+        formatted_data, (metric_names, STRATEGY, CORPUS_CARDINALITY)
+    )
+
+    # Incremental mode only scores new or changed patients and reuses stored scores
+    to_score = np.ones(cohort.nb_patients, dtype=bool)
+    previous_scores = {}
+    if incremental:
+        to_score, previous_scores = read_previous_scores(
+            cohort.patient_id, row_hashes, metric_names
         )
-    }
+        long_table = True
+        print("Number of patients to score : ", to_score.sum())
 
-    for criterium in CRITERIA:
-        for tool in TrialMatchingTools.all():
-            for _, patient_row in formatted_data.iterrows():
-                ranking = patient_row[tool]
-                relevance = patient_row[criterium]
-                patient_id = patient_row["patient_id"]
-
-                total_relevance, specific_relevance = (
-                    calculate_total_specific_relevance(
-                        formatted_data, criterium, patient_id
-                    )
-                )
-
-                for metric in unranked_metrics + ranked_metrics:
-                    current_score = metric.compute(
-                        ranking=ranking,
-                        relevance=relevance,
-                        nb_all_trials_retrieved=trials_retrieved_count_by_patient[
-                            patient_id
-                        ],
-                        total_relevance=total_relevance,
-                        specific_relevance=specific_relevance,
-                    )
-
-                    append_metrics_dict(
-                        metrics_dict=metrics,
-                        metric=metric,
-                        score=current_score,
-                        tool=tool,
-                        patient_id=patient_id,
-                        criterium=criterium,
-                    )
+    aggregator = MetricAggregator(
+        metric_names,
+        [
+            (criterium, tool)
+            for criterium in CRITERIA
+            for tool in TrialMatchingTools.all()
+        ],
+        cohort.nb_patients,
+    )
+    for (criterium, tool), kept_scores in previous_scores.items():
+        aggregator.update(criterium, tool, kept_scores, ~to_score)
+
+    # Shards are written at their patient positions as they complete
+    scored_patients = np.flatnonzero(to_score)
+    for patients, shard_scores in imap_shards(
+        compute_scores, cohort.take(scored_patients), workers, metrics=all_metrics
+    ):
+        for (criterium, tool), block in shard_scores.items():
+            aggregator.update(criterium, tool, block, scored_patients[patients])
 
     # -------------------------------------- Save metrics --------------------------------------
 
-    df_metrics = pd.DataFrame(metrics)
-    df_aggregation_metrics = pd.concat(
-        [
-            df_metrics.groupby(["metric_name", "criterium", "tool"])["value"]
-            .agg(["mean", "median", "std", "count"])
-            .reset_index(),
-            df_metrics.groupby(["metric_name", "criterium"])["value"]
-            .agg(["mean", "median", "std", "count"])
-            .reset_index(),
-        ]
-    ).fillna({"tool": "all"})
+    df_metrics = None
+    if long_table:
+        blocks = [(*key, block) for key, block in aggregator.scores.items()]
+        store = MetricsStore.from_blocks(blocks, metric_names, cohort.patient_id)
+        df_metrics = store.to_frame()
+    df_aggregation_metrics = aggregator.to_frame()
 
     print("Number of metrics : ", len(df_aggregation_metrics))
 
-    df_metrics.to_csv(METRICS_PATH, index=False)
+    if long_table:
+        df_metrics.to_csv(METRICS_PATH, index=False)
+        store.save(METRICS_STORE_PATH)
+        write_metrics_state(cohort.patient_id, row_hashes)
     df_aggregation_metrics.to_csv(AGGREGATION_METRICS_PATH, index=False)
 
     metrics_for_png = [
@@ -181,4 +181,4 @@ def main(formatted_data: pd.DataFrame):
 
 if __name__ == "__main__":
     formatted_data = get_formatted_data(FORMATTED_CSV_PATH)
-    main(formatted_data)
+    main(formatted_data, long_table=True)
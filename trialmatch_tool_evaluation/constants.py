@@ -1,5 +1,3 @@
-import plotly.express as px
-
 CRITERIA = ["eligibility", "status", "eligibility_and_status"]
 
 
@@ -20,9 +18,16 @@ class TrialMatchingTools:
 
 
 K_VALUES = [3, 5, 10]
+CURVE_K_MAX = 20
 STRATEGY = None
 CORPUS_CARDINALITY = 85326
 
+NB_RESAMPLES = 10000
+NB_PERMUTATIONS = 10000
+EXACT_PERMUTATION_MAX_PATIENTS = 16
+CONFIDENCE_LEVEL = 0.95
+RANDOM_SEED = 0
+
 DISPLAYED_CRITERIA = {
     "eligibility": "Eligibility",
     "status": "Status",
@@ -66,4 +71,13 @@ UNIQUE_CRITERIA_CATEGORIES = [
 ]
 
 
-PLOT_COLORS = list(px.colors.qualitative.Set2 + px.colors.qualitative.Pastel)
+def __getattr__(name):
+    # PLOT_COLORS comes from plotly, which is only imported by the stages that plot
+    if name == "PLOT_COLORS":
+        import plotly.express as px
+
+        globals()[name] = list(
+            px.colors.qualitative.Set2 + px.colors.qualitative.Pastel
+        )
+        return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
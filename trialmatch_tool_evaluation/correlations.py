@@ -1,121 +1,155 @@
 import itertools
 
+import numpy as np
 import pandas as pd
-from scipy.stats import spearmanr
+from scipy.stats import rankdata
+from scipy.stats import t as t_distribution
 
-from trialmatch_tool_evaluation import PLOTS_FOLDER
+from trialmatch_tool_evaluation import PLOTS_FOLDER, RESULTS_FOLDER
 from trialmatch_tool_evaluation._utils import dfi_export_proxy
 from trialmatch_tool_evaluation.constants import CRITERIA, K_VALUES, TrialMatchingTools
+from trialmatch_tool_evaluation.metrics.batch import divide
 from trialmatch_tool_evaluation.metrics.ranked_metrics import (
     AP_at_k,
     NDCG_at_k,
     NFPR_at_k,
 )
+from trialmatch_tool_evaluation.metrics_store import MetricsStore
 
 CORRELATIONS_FOLDER = PLOTS_FOLDER / "correlations"
+CORRELATIONS_PATH = RESULTS_FOLDER / "spearman_correlations.csv"
+
+
+def spearman_matrix(values):
+    # values holds one row per patient and one column per metric, NaN when missing.
+    # Pairs use the patients scored on both metrics: columns sharing a missing
+    # pattern are ranked together, then correlated with one matrix product.
+    nb_metrics = values.shape[1]
+    correlation = np.full((nb_metrics, nb_metrics), np.nan)
+    nb_patients = np.zeros((nb_metrics, nb_metrics), dtype=int)
+
+    masks, pattern = np.unique(~np.isnan(values), axis=1, return_inverse=True)
+    pattern = pattern.ravel()
+    for i, j in itertools.combinations_with_replacement(range(masks.shape[1]), 2):
+        rows = masks[:, i] & masks[:, j]
+        columns_i = np.flatnonzero(pattern == i)
+        columns_j = np.flatnonzero(pattern == j)
+        columns = np.concatenate([columns_i, columns_j]) if i != j else columns_i
+
+        ranks = rankdata(values[np.ix_(rows, columns)], axis=0)
+        ranks -= ranks.mean(axis=0)
+        standardized = divide(ranks, np.sqrt((ranks**2).sum(axis=0)))
+        block = standardized.T @ standardized
+
+        # Pairs within a pattern are only correlated on that pattern's patients
+        if i == j:
+            pairs = [(columns_i, columns_i, block)]
+        else:
+            cross = block[: len(columns_i), len(columns_i) :]
+            pairs = [(columns_i, columns_j, cross), (columns_j, columns_i, cross.T)]
+        for first, second, source in pairs:
+            correlation[np.ix_(first, second)] = source
+            nb_patients[np.ix_(first, second)] = rows.sum()
+
+    # Two-sided p-values from the t distribution, as scipy's spearmanr
+    correlation = np.clip(correlation, -1, 1)
+    dof = nb_patients - 2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t = correlation * np.sqrt(
+            (dof / ((correlation + 1.0) * (1.0 - correlation))).clip(0)
+        )
+        pvalue = 2 * t_distribution.sf(np.abs(t), dof)
+    return correlation, pvalue, nb_patients
 
 
-def spearman_correlation(list1, list2):
-    corr = spearmanr(
-        [e for e in list1 if e is not None],
-        [e for e in list2 if e is not None],
-    )
-    return round(corr.statistic, 3), corr.pvalue
-
-
-def append_correlations_dict(
-    correlations_dict, tool, metric1_name, metric2_name, corr, pvalue
-):
-    correlations_dict["tool"].append(tool)
-    correlations_dict["metric_1"].append(metric1_name)
-    correlations_dict["metric_2"].append(metric2_name)
-    correlations_dict["correlation"].append(corr)
-    correlations_dict["pvalue"].append(pvalue)
-
-
-def add_correlation(df_metrics, metric1, metric2, criterium, tool, correlations):
-    metric_mask = (df_metrics["criterium"] == criterium) & (df_metrics["tool"] == tool)
-    metric_1_mask = (df_metrics["metric_name"] == metric1) & metric_mask
-    metric_2_mask = (df_metrics["metric_name"] == metric2) & metric_mask
-
-    metric1_values = df_metrics[metric_1_mask]["value"].dropna().tolist()
-    metric2_values = df_metrics[metric_2_mask]["value"].dropna().tolist()
-    corr, pvalue = spearman_correlation(metric1_values, metric2_values)
+def get_correlations(df_metrics: pd.DataFrame):
+    values, keys = MetricsStore.from_frame(df_metrics).matrix()
+    columns = {key: i for i, key in enumerate(keys)}
 
-    append_correlations_dict(correlations, tool, metric1, metric2, corr, pvalue)
+    correlations = []
+    for criterium in CRITERIA:
+        for tool in TrialMatchingTools.all():
+            metric_names = [
+                metric for metric, c, t in keys if c == criterium and t == tool
+            ]
+            group_values = values[
+                :, [columns[(metric, criterium, tool)] for metric in metric_names]
+            ]
+            # Patients without any score for this tool are not part of the group
+            group_values = group_values[~np.isnan(group_values).all(axis=1)]
+            correlation, pvalue, nb_patients = spearman_matrix(group_values)
+
+            metric_1, metric_2 = np.meshgrid(
+                range(len(metric_names)), range(len(metric_names)), indexing="ij"
+            )
+            correlations.append(
+                pd.DataFrame(
+                    {
+                        "criterium": criterium,
+                        "tool": tool,
+                        "metric_1": np.array(metric_names)[metric_1.ravel()],
+                        "metric_2": np.array(metric_names)[metric_2.ravel()],
+                        "correlation": correlation.ravel(),
+                        "pvalue": pvalue.ravel(),
+                        "nb_patients": nb_patients.ravel(),
+                    }
+                )
+            )
+    return pd.concat(correlations, ignore_index=True)
+
+
+def correlation_table(df_correlations, criterium, metric_pairs):
+    df_correlations = df_correlations[
+        df_correlations["criterium"] == criterium
+    ].set_index(["tool", "metric_1", "metric_2"])
+
+    correlations = []
+    for tool in TrialMatchingTools.all():
+        for metric1, metric2 in metric_pairs:
+            correlation = df_correlations.loc[(tool, metric1, metric2)]
+            correlations.append(
+                {
+                    "tool": tool,
+                    "metric_1": metric1,
+                    "metric_2": metric2,
+                    "correlation": round(correlation["correlation"], 3),
+                    "pvalue": correlation["pvalue"],
+                }
+            )
+    return pd.DataFrame(correlations)
 
 
 def main(df_metrics: pd.DataFrame):
     CORRELATIONS_FOLDER.mkdir(exist_ok=True)
 
-    df_metrics = df_metrics.copy()
+    df_correlations = get_correlations(df_metrics)
+    df_correlations.to_csv(CORRELATIONS_PATH, index=False)
+
     # ----------------------------- Correlations between AP and NDCG -----------------------------
 
     for criterium in CRITERIA:
-
-        correlations = {
-            "tool": [],
-            "metric_1": [],
-            "metric_2": [],
-            "correlation": [],
-            "pvalue": [],
-        }
-
-        for tool in TrialMatchingTools.all():
-
-            for k in K_VALUES:
-
-                add_correlation(
-                    df_metrics,
-                    metric1=AP_at_k(k=k).name,
-                    metric2=NDCG_at_k(k=k).name,
-                    criterium=criterium,
-                    tool=tool,
-                    correlations=correlations,
-                )
-
-        df_correlations = pd.DataFrame(correlations)
-        file_path = CORRELATIONS_FOLDER / f"correlations_ap_ndcg_{criterium}.png"
-        dfi_export_proxy(
-            df_correlations.round({"correlation": 3, "pvalue": 20}), file_path
+        df_table = correlation_table(
+            df_correlations,
+            criterium,
+            [(AP_at_k(k=k).name, NDCG_at_k(k=k).name) for k in K_VALUES],
         )
+        file_path = CORRELATIONS_FOLDER / f"correlations_ap_ndcg_{criterium}.png"
+        dfi_export_proxy(df_table.round({"correlation": 3, "pvalue": 20}), file_path)
 
     # ----------------------- NDCG and AP correlations between ranks 3, 5, 10 -----------------------
 
     for criterium in CRITERIA:
-
-        correlations = {
-            "tool": [],
-            "metric_1": [],
-            "metric_2": [],
-            "correlation": [],
-            "pvalue": [],
-        }
-
-        for tool in TrialMatchingTools.all():
-
-            for metric in [AP_at_k, NDCG_at_k, NFPR_at_k]:
-
-                k_combinations = itertools.combinations(K_VALUES, 2)
-                for k in k_combinations:
-
-                    metric1_name = metric(k=k[0]).name
-                    metric2_name = metric(k=k[1]).name
-
-                    add_correlation(
-                        df_metrics,
-                        metric1_name,
-                        metric2_name,
-                        criterium=criterium,
-                        tool=tool,
-                        correlations=correlations,
-                    )
-
-        df_correlations = pd.DataFrame(correlations)
-        file_path = CORRELATIONS_FOLDER / f"correlations_rank_{criterium}.png"
-        dfi_export_proxy(
-            df_correlations.round({"correlation": 3, "pvalue": 20}), file_path
+        df_table = correlation_table(
+            df_correlations,
+            criterium,
+            [
+                (metric(k=k1).name, metric(k=k2).name)
+                for metric in [AP_at_k, NDCG_at_k, NFPR_at_k]
+                for k1, k2 in itertools.combinations(K_VALUES, 2)
+            ],
         )
+        file_path = CORRELATIONS_FOLDER / f"correlations_rank_{criterium}.png"
+        dfi_export_proxy(df_table.round({"correlation": 3, "pvalue": 20}), file_path)
 
 
 if __name__ == "__main__":
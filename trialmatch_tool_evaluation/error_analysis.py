@@ -1,8 +1,16 @@
+from dataclasses import dataclass
+
+import numpy as np
 import pandas as pd
 import plotly.express as px
 
-from trialmatch_tool_evaluation import FORMATTED_CSV_PATH, PLOTS_FOLDER
-from trialmatch_tool_evaluation._utils import union_binary
+from trialmatch_tool_evaluation import (
+    EXCLUSION_CRITERIA_PATH,
+    FALSE_POSITIVES_PATH,
+    FORMATTED_CSV_PATH,
+    PLOTS_FOLDER,
+)
+from trialmatch_tool_evaluation.cohort import Cohort
 from trialmatch_tool_evaluation.constants import (
     CRITERIA,
     DISPLAYED_CRITERIA,
@@ -11,9 +19,13 @@ from trialmatch_tool_evaluation.constants import (
     UNIQUE_CRITERIA_CATEGORIES,
     TrialMatchingTools,
 )
-from trialmatch_tool_evaluation.metrics import FP
-from trialmatch_tool_evaluation.patient_data import PatientData
+from trialmatch_tool_evaluation.parallel import (
+    concatenate_shards,
+    map_shards,
+    sum_shards,
+)
 from trialmatch_tool_evaluation.preprocess_files import get_formatted_data
+from trialmatch_tool_evaluation.rendering import write_image
 
 
 def plot_error_rates(df_errors):
@@ -57,38 +69,17 @@ def plot_error_rates(df_errors):
         uniformtext_minsize=12,
         uniformtext_mode="hide",
     )
-    fig.write_image(PLOTS_FOLDER / "nb_errors_bar_plot.png")
-
-
-def plot_exclusion_criteria(df, nb_patients, colors, tool="all", tumor_type="all"):
+    write_image(fig, PLOTS_FOLDER / "nb_errors_bar_plot.png")
 
-    if tumor_type == "all":
-        subset = df
-    else:
-        subset = df[df["tumor_type"] == tumor_type]
 
-    if tool == "all":
-        all_categories = sum(
-            [l for l in subset["exclusion_criteria_all_tools"].tolist()], []
-        )
-        x_range = [0, 301]
-    else:
-        all_categories = sum(
-            [l for l in subset[f"exclusion_criteria_{tool}"].tolist()], []
-        )
-        x_range = [0, 121]
-    unique_categories = list(set(all_categories))
-    df = pd.DataFrame(
-        {
-            "category": unique_categories,
-            "value": [
-                len([k for k in all_categories if k == c]) for c in unique_categories
-            ],
-        }
-    )
+def plot_exclusion_criteria(counts, nb_patients, colors, tool="all", tumor_type="all"):
+    # counts holds the number of errors per exclusion category
+    x_range = [0, 301] if tool == "all" else [0, 121]
+    counts = counts[counts > 0]
+    df = pd.DataFrame({"category": counts.index, "value": counts.to_numpy()})
     df = df.assign(percent=lambda x: x["value"] / df["value"].sum() * 100)
-    df = df.sort_values(by="value", ascending=False)
-    tumor_type = TUMOR_TYPES_TRANSLATION[tumor_type].lower()
+    df = df.sort_values(by="value", ascending=False, kind="stable")
+    tumor_type = TUMOR_TYPES_TRANSLATION.get(tumor_type, tumor_type).lower()
 
     fig = px.bar(
         df,
@@ -106,39 +97,126 @@ def plot_exclusion_criteria(df, nb_patients, colors, tool="all", tumor_type="all
     fig.update_xaxes(title_text="Number of errors", range=x_range)
     fig.update_yaxes(title_text="Category of error")
     fig.update_layout(title_font_size=12, showlegend=False)
-    fig.write_image(
-        PLOTS_FOLDER / f"exclusion_criteria_{tool}_tool_{tumor_type}_tumors.png"
+    write_image(
+        fig, PLOTS_FOLDER / f"exclusion_criteria_{tool}_tool_{tumor_type}_tumors.png"
     )
 
 
-def main(formatted_data: pd.DataFrame):
+def compute_false_positives(cohort: Cohort):
+    # A retrieved trial is a false positive for a cause when it is not relevant for it,
+    # "eligibility_and_status" meaning relevant for neither
+    not_relevant = {
+        "eligibility": cohort.eligibility == 0,
+        "status": cohort.status == 0,
+        "eligibility_and_status": np.maximum(cohort.eligibility, cohort.status) == 0,
+    }
+    false_positives = {}
+    for tool in TrialMatchingTools.all():
+        retrieved = cohort.rankings[tool] > 0
+        for criterium in CRITERIA:
+            false_positives[(tool, criterium)] = cohort.segment_sum(
+                retrieved & not_relevant[criterium]
+            )
+    return false_positives
+
+
+def get_false_positives_table(cohort: Cohort, workers: int = 1):
+    # One row per (tool, cause, patient) with the number of false positives
+    false_positives = concatenate_shards(
+        map_shards(compute_false_positives, cohort, workers)
+    )
+    return pd.concat(
+        [
+            pd.DataFrame(
+                {
+                    "patient_id": cohort.patient_id,
+                    "tumor_type": cohort.tumor_type,
+                    "tool": tool,
+                    "criterium": criterium,
+                    "nb_errors": nb_errors,
+                }
+            )
+            for (tool, criterium), nb_errors in false_positives.items()
+        ],
+        ignore_index=True,
+    )
+
+
+@dataclass
+class ExclusionCube:
+    # Number of exclusion categories indexed by (tool, tumor type, category): the
+    # trials retrieved by each tool, and every trial for the "all" tool
+    counts: np.ndarray
+    tools: list
+    tumor_types: list
+    categories: list
+
+    def slice(self, tool="all", tumor_type="all"):
+        counts = self.counts[self.tools.index(tool)]
+        if tumor_type == "all":
+            counts = counts.sum(axis=0)
+        elif tumor_type in self.tumor_types:
+            counts = counts[self.tumor_types.index(tumor_type)]
+        else:
+            counts = np.zeros(len(self.categories), dtype=counts.dtype)
+        return pd.Series(counts, index=self.categories, name="nb_errors")
+
+    def to_frame(self):
+        index = pd.MultiIndex.from_product(
+            [self.tools, self.tumor_types, self.categories],
+            names=["tool", "tumor_type", "category"],
+        )
+        return pd.DataFrame({"nb_errors": self.counts.ravel()}, index=index)
+
+
+def compute_exclusion_counts(cohort: Cohort, tumor_types):
+    nb_categories = len(cohort.exclusion_categories)
+    nb_cells = len(tumor_types) * nb_categories
+    tumor_codes = pd.Index(tumor_types).get_indexer(cohort.tumor_type)
+    pair_tumor_codes = tumor_codes[cohort.segment_ids]
+
+    # Every trial for the "all" tool, the retrieved ones for each tool
+    selections = [np.ones(cohort.nb_pairs, dtype=bool)] + [
+        cohort.rankings[t] != 0 for t in TrialMatchingTools.all()
+    ]
+    counts = np.zeros((len(selections), nb_cells), dtype=np.int64)
+    for category in [cohort.exclusion_category_1, cohort.exclusion_category_2]:
+        cells = pair_tumor_codes * nb_categories + category
+        for i, selected in enumerate(selections):
+            counts[i] += np.bincount(
+                cells[selected & (category != -1)], minlength=nb_cells
+            )
+    return {"counts": counts.reshape(len(selections), len(tumor_types), -1)}
+
+
+def get_exclusion_cube(cohort: Cohort, workers: int = 1):
+    tumor_types = pd.unique(cohort.tumor_type).tolist()
+    counts = sum_shards(
+        map_shards(compute_exclusion_counts, cohort, workers, tumor_types=tumor_types)
+    )["counts"]
+    return ExclusionCube(
+        counts=counts,
+        tools=["all"] + TrialMatchingTools.all(),
+        tumor_types=tumor_types,
+        categories=cohort.exclusion_categories.tolist(),
+    )
+
+
+def main(formatted_data: pd.DataFrame, workers: int = 1):
 
     # --------------------------------- Plot error rates ---------------------------------
 
-    tools_list, criteria_list, nb_errors_list = [], [], []
     nb_patients = len(formatted_data)
+    cohort = Cohort.from_formatted_data(formatted_data)
+    df_false_positives = get_false_positives_table(cohort, workers)
+    df_false_positives.to_csv(FALSE_POSITIVES_PATH, index=False)
 
-    for tool in TrialMatchingTools.all():
-        for criterium in CRITERIA:
-            tools_list.append(tool)
-            criteria_list.append(criterium)
-
-            nb_errors = 0
-            for i in formatted_data["patient_id"].tolist():
-                patient_data = formatted_data[formatted_data["patient_id"] == i]
-                ranking = patient_data[tool].tolist()[0]
-                if criterium == "eligibility_and_status":
-                    relevance = union_binary(
-                        patient_data["eligibility"].iloc[0],
-                        patient_data["status"].iloc[0],
-                    )
-                else:
-                    relevance = patient_data[criterium].tolist()[0]
-                nb_errors += FP().compute(ranking, relevance)
-            nb_errors_list.append(nb_errors / nb_patients)
-
-    df_errors = pd.DataFrame(
-        {"tool": tools_list, "criterium": criteria_list, "nb_errors": nb_errors_list}
+    # Average number of false positives per patient, in tool then criterium order
+    df_errors = (
+        df_false_positives.groupby(["tool", "criterium"], sort=False)["nb_errors"]
+        .sum()
+        .div(nb_patients)
+        .reset_index()
     )
 
     plot_error_rates(df_errors)
@@ -150,57 +228,37 @@ def main(formatted_data: pd.DataFrame):
         for k in range(len(UNIQUE_CRITERIA_CATEGORIES))
     }
 
-    data = {
-        "patient_id": [],
-        "tumor_type": [],
-        "exclusion_criteria_all_tools": [],
-        "exclusion_criteria_per_tool": {t: [] for t in TrialMatchingTools.all()},
-    }
-
-    for _, patient_values in formatted_data.iterrows():
-        patient_data = PatientData.from_ranking(patient_values.to_dict())
-        data["patient_id"].append(patient_data.patient_id)
-        data["tumor_type"].append(patient_data.tumor_type)
-
-        data["exclusion_criteria_all_tools"].append(
-            [
-                c
-                for c in (
-                    patient_data.exclusion_category_1
-                    + patient_data.exclusion_category_2
-                )
-                if c is not None
-            ]
-        )
-
-        for t in TrialMatchingTools.all():
-            tool_criteria = []
-            for i in range(patient_data.nb_all_trials_retrieved):
-                if patient_data.rankings[t][i] != 0:
-                    if patient_data.exclusion_category_1[i] is not None:
-                        tool_criteria.append(patient_data.exclusion_category_1[i])
-                    if patient_data.exclusion_category_2[i] is not None:
-                        tool_criteria.append(patient_data.exclusion_category_2[i])
-            data["exclusion_criteria_per_tool"][t].append(tool_criteria)
+    cube = get_exclusion_cube(cohort, workers)
+    cube.to_frame().to_csv(EXCLUSION_CRITERIA_PATH)
 
     print("Total number of patients : ", nb_patients)
 
-    for t in TrialMatchingTools.all():
-        data[f"exclusion_criteria_{t}"] = data["exclusion_criteria_per_tool"][t]
-    del data["exclusion_criteria_per_tool"]
-    df = pd.DataFrame(data)
-
     plot_exclusion_criteria(
-        df, nb_patients, exclusion_criteria_colors, tool="all", tumor_type="all"
+        cube.slice(tool="all", tumor_type="all"),
+        nb_patients,
+        exclusion_criteria_colors,
+        tool="all",
+        tumor_type="all",
     )
     for t in TrialMatchingTools.all():
         plot_exclusion_criteria(
-            df, nb_patients, exclusion_criteria_colors, tool=t, tumor_type="all"
+            cube.slice(tool=t, tumor_type="all"),
+            nb_patients,
+            exclusion_criteria_colors,
+            tool=t,
+            tumor_type="all",
         )
 
-    for t in ["DIGESTIF", "MAMMAIRE", "SARCOMES", "UROLOGIE", "GYNECOLOGIQUE"]:
+    # Tumor types of the cohort, patients without one only count in "all"
+    for t in cube.tumor_types:
+        if pd.isna(t):
+            continue
         plot_exclusion_criteria(
-            df, nb_patients, exclusion_criteria_colors, tool="all", tumor_type=t
+            cube.slice(tool="all", tumor_type=t),
+            nb_patients,
+            exclusion_criteria_colors,
+            tool="all",
+            tumor_type=t,
         )
 
 
@@ -0,0 +1,55 @@
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+from trialmatch_tool_evaluation import METRICS_STATE_PATH, METRICS_STORE_PATH
+from trialmatch_tool_evaluation.constants import CRITERIA, TrialMatchingTools
+from trialmatch_tool_evaluation.metrics_store import MetricsStore
+
+
+def get_row_hashes(formatted_data: pd.DataFrame, signature):
+    # The signature (metrics configuration) invalidates every row when it changes
+    return np.array(
+        [
+            hashlib.sha256(repr((signature, row)).encode()).hexdigest()
+            for row in formatted_data.itertuples(index=False, name=None)
+        ]
+    )
+
+
+def write_metrics_state(patient_ids, row_hashes):
+    pd.DataFrame({"patient_id": patient_ids, "row_hash": row_hashes}).to_csv(
+        METRICS_STATE_PATH, index=False
+    )
+
+
+def read_previous_scores(patient_ids, row_hashes, metric_names):
+    # Returns the patients to score and, per (criterium, tool), the stored scores
+    # of the others in patient order
+    to_score = np.ones(len(patient_ids), dtype=bool)
+    if not (METRICS_STORE_PATH.exists() and METRICS_STATE_PATH.exists()):
+        return to_score, {}
+
+    state = pd.read_csv(METRICS_STATE_PATH, dtype=str)
+    previous_hashes = dict(zip(state["patient_id"], state["row_hash"]))
+    to_score = np.array(
+        [
+            previous_hashes.get(str(patient_id)) != row_hash
+            for patient_id, row_hash in zip(patient_ids, row_hashes)
+        ],
+        dtype=bool,
+    )
+    kept = patient_ids[~to_score]
+
+    store = MetricsStore.load(METRICS_STORE_PATH)
+    scores = {}
+    for criterium in CRITERIA:
+        for tool in TrialMatchingTools.all():
+            scores[(criterium, tool)], nb_found = store.scores(
+                criterium, tool, metric_names, kept
+            )
+            # Rescore everyone when the stored table does not cover the kept patients
+            if nb_found != len(kept) * len(metric_names):
+                return np.ones(len(patient_ids), dtype=bool), {}
+    return to_score, scores
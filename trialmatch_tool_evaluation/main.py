@@ -1,30 +1,121 @@
-from trialmatch_tool_evaluation import FORMATTED_CSV_PATH
-from trialmatch_tool_evaluation.compute_metrics import main as compute_metrics
-from trialmatch_tool_evaluation.correlations import main as compute_correlations
-from trialmatch_tool_evaluation.error_analysis import main as compute_error_analyis
-from trialmatch_tool_evaluation.molecular_alterations_stats import (
-    main as compute_molecular_alteration_analysis,
-)
-from trialmatch_tool_evaluation.nb_trials_stats import main as compute_nb_trials_stats
-from trialmatch_tool_evaluation.plot_metrics import main as plot_metrics
+import argparse
+
+from trialmatch_tool_evaluation import FORMATTED_CSV_PATH, METRICS_STORE_PATH
+from trialmatch_tool_evaluation._utils import get_aggregation_metrics
+from trialmatch_tool_evaluation.artifact_cache import save_manifest
+from trialmatch_tool_evaluation.metrics_store import MetricsStore
 from trialmatch_tool_evaluation.preprocess_files import get_formatted_data
-from trialmatch_tool_evaluation.statistical_tests import main as compute_ttests
-from trialmatch_tool_evaluation.wrong_status_trials_stats import (
-    main as compute_wrongs_status_stats,
-)
+from trialmatch_tool_evaluation.rendering import render_queue
+from trialmatch_tool_evaluation.stages import Stage, run_stages, select_stages
+
+PACKAGE = "trialmatch_tool_evaluation"
+
+STAGES = [
+    Stage(
+        "compute_metrics",
+        f"{PACKAGE}.compute_metrics:main",
+        inputs=("formatted_data",),
+        outputs=("df_metrics", "df_aggregation_metrics"),
+        options=("workers", "incremental", "long_table"),
+    ),
+    Stage("metric_curves", f"{PACKAGE}.metric_curves:main", inputs=("formatted_data",)),
+    Stage(
+        "nb_trials_stats",
+        f"{PACKAGE}.nb_trials_stats:main",
+        inputs=("formatted_data",),
+        options=("workers",),
+    ),
+    Stage(
+        "error_analysis",
+        f"{PACKAGE}.error_analysis:main",
+        inputs=("formatted_data",),
+        options=("workers",),
+    ),
+    Stage(
+        "molecular_alterations_stats",
+        f"{PACKAGE}.molecular_alterations_stats:main",
+        inputs=("formatted_data",),
+    ),
+    Stage(
+        "wrong_status_trials_stats",
+        f"{PACKAGE}.wrong_status_trials_stats:main",
+        inputs=("formatted_data",),
+    ),
+    Stage(
+        "statistical_tests",
+        f"{PACKAGE}.statistical_tests:main",
+        inputs=("df_metrics",),
+    ),
+    Stage(
+        "bootstrap",
+        f"{PACKAGE}.bootstrap:main",
+        inputs=("df_metrics",),
+        options=("workers",),
+    ),
+    Stage("correlations", f"{PACKAGE}.correlations:main", inputs=("df_metrics",)),
+    Stage(
+        "stratified_metrics",
+        f"{PACKAGE}.stratification:main",
+        inputs=("formatted_data", "df_metrics"),
+    ),
+    Stage(
+        "plot_metrics",
+        f"{PACKAGE}.plot_metrics:main",
+        inputs=("df_metrics", "df_aggregation_metrics"),
+    ),
+]
+
+# Inputs of stages that are not run come from the files of the previous run
+LOADERS = {
+    "formatted_data": lambda: get_formatted_data(FORMATTED_CSV_PATH),
+    "df_metrics": lambda: MetricsStore.load(METRICS_STORE_PATH).to_frame(),
+    "df_aggregation_metrics": get_aggregation_metrics,
+}
 
 if __name__ == "__main__":
+    stage_names = [stage.name for stage in STAGES]
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of processes running independent stages, or the patient shards of a single stage (1 runs serially)",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only score patients that are new or changed since the last run",
+    )
+    selection = parser.add_mutually_exclusive_group()
+    selection.add_argument(
+        "--only", nargs="+", choices=stage_names, help="Stages to run"
+    )
+    selection.add_argument(
+        "--skip", nargs="+", choices=stage_names, help="Stages not to run"
+    )
+    args = parser.parse_args()
+
     print("Starting ...")
 
-    formatted_data = get_formatted_data(FORMATTED_CSV_PATH)
-    df_metrics, df_aggregation_metrics = compute_metrics(formatted_data=formatted_data)
+    stages = select_stages(STAGES, only=args.only, skip=args.skip)
+    # The per-patient metrics table is only built when a selected stage reads it
+    long_table = any("df_metrics" in stage.inputs for stage in stages)
 
-    compute_nb_trials_stats(formatted_data=formatted_data)
-    compute_error_analyis(formatted_data=formatted_data)
-    compute_molecular_alteration_analysis(formatted_data=formatted_data)
-    compute_wrongs_status_stats(formatted_data=formatted_data)
-    compute_ttests(df_metrics=df_metrics)
-    compute_correlations(df_metrics=df_metrics)
-    plot_metrics(df_metrics=df_metrics, df_aggregation_metrics=df_aggregation_metrics)
+    # Plots are exported together once every stage has built them
+    with render_queue(workers=args.workers):
+        timings = run_stages(
+            stages,
+            LOADERS,
+            options={
+                "workers": args.workers,
+                "incremental": args.incremental,
+                "long_table": long_table,
+            },
+            workers=args.workers,
+        )
+    save_manifest()
 
+    for name, elapsed in timings.items():
+        print(f"{name:<30}{elapsed:>8.1f}s")
     print("Success !")
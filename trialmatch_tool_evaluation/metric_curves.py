@@ -0,0 +1,103 @@
+from typing import List
+
+import pandas as pd
+import plotly.express as px
+
+from trialmatch_tool_evaluation import (
+    FORMATTED_CSV_PATH,
+    METRIC_CURVES_PATH,
+    PLOTS_FOLDER,
+)
+from trialmatch_tool_evaluation.cohort import Cohort
+from trialmatch_tool_evaluation.constants import (
+    CRITERIA,
+    CURVE_K_MAX,
+    DISPLAYED_CRITERIA,
+    PLOT_COLORS,
+    STRATEGY,
+    TrialMatchingTools,
+)
+from trialmatch_tool_evaluation.metrics import (
+    AP_at_k,
+    MetricBatch,
+    NDCG_at_k,
+    NFPR_at_k,
+    Precision_at_k,
+    Sensitivity_at_k,
+)
+from trialmatch_tool_evaluation.metrics.base_metrics import RankedMetric
+from trialmatch_tool_evaluation.preprocess_files import get_formatted_data
+from trialmatch_tool_evaluation.rendering import write_image
+
+
+def plot_metric_curves(df_curves: pd.DataFrame):
+    df_curves = df_curves.assign(
+        criterium=df_curves["criterium"].map(DISPLAYED_CRITERIA)
+    )
+    fig = px.line(
+        df_curves,
+        x="k",
+        y="mean",
+        color="tool",
+        facet_row="metric_name",
+        facet_col="criterium",
+        markers=True,
+        color_discrete_sequence=PLOT_COLORS,
+        width=1400,
+        height=1400,
+        title="Mean metric value per cut-off k",
+    )
+    fig.update_yaxes(matches=None, showticklabels=True, title_text="")
+    fig.for_each_annotation(lambda a: a.update(text=a.text.split("=")[-1]))
+    write_image(fig, PLOTS_FOLDER / "metric_curves.png")
+
+
+def main(formatted_data: pd.DataFrame, k_max: int = CURVE_K_MAX):
+
+    # -------------------------------------- Compute metric curves --------------------------------------
+
+    curve_metrics: List[RankedMetric] = [
+        Precision_at_k(k=k_max, strategy=STRATEGY),
+        Sensitivity_at_k(k=k_max, strategy=STRATEGY),
+        AP_at_k(k=k_max, strategy=STRATEGY),
+        NDCG_at_k(k=k_max, strategy=STRATEGY),
+        NFPR_at_k(k=k_max, strategy=STRATEGY),
+    ]
+    cohort = Cohort.from_formatted_data(formatted_data)
+
+    curves = []
+    for criterium in CRITERIA:
+        for tool in TrialMatchingTools.all():
+            batch = MetricBatch(
+                ranking=cohort.rankings[tool],
+                relevance=cohort.relevance(criterium),
+                offsets=cohort.offsets,
+            )
+            for metric in curve_metrics:
+                # One column per k, aggregated over patients (NaN skipped)
+                curve = pd.DataFrame(metric.compute_curve(batch, k_max))
+                aggregation = curve.agg(["mean", "std", "count"]).T
+                curves.append(
+                    aggregation.assign(
+                        metric_name=metric.generic_name.format(k="k"),
+                        criterium=criterium,
+                        tool=tool,
+                        k=range(1, k_max + 1),
+                    )
+                )
+
+    # -------------------------------------- Save metric curves --------------------------------------
+
+    df_curves = pd.concat(curves, ignore_index=True)[
+        ["metric_name", "criterium", "tool", "k", "mean", "std", "count"]
+    ].astype({"count": int})
+    df_curves.to_csv(METRIC_CURVES_PATH, index=False)
+
+    plot_metric_curves(df_curves)
+
+    return df_curves
+
+
+if __name__ == "__main__":
+    formatted_data = get_formatted_data(FORMATTED_CSV_PATH)
+    main(formatted_data)
@@ -1,3 +1,4 @@
+from .batch import MetricBatch
 from .classification_metrics import (
     TP,
     FP,
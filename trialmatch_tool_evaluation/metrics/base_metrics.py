@@ -1,5 +1,8 @@
+import copy
 from abc import abstractmethod
 
+import numpy as np
+
 
 class Metric:
     name: str
@@ -15,6 +18,13 @@ class Metric:
     ) -> float:
         pass
 
+    def compute_batch(self, batch) -> np.ndarray:
+        # Generic fallback, metrics override it with a vectorized implementation
+        scores = [
+            self.compute(**batch.patient_arguments(i)) for i in range(batch.nb_patients)
+        ]
+        return np.array([np.nan if s is None else s for s in scores], dtype=float)
+
     def __str__(self):
         return f"name: {self.name}"
 
@@ -29,3 +39,12 @@ class RankedMetric(Metric):
 
     def __init__(self, k):
         self.k = k
+
+    def compute_curve(self, batch, k_max) -> np.ndarray:
+        # One column per cut-off k = 1..k_max, metrics override it with a single sweep
+        curve = []
+        for k in range(1, k_max + 1):
+            metric = copy.copy(self)
+            metric.k = k
+            curve.append(metric.compute_batch(batch))
+        return np.column_stack(curve)
@@ -0,0 +1,124 @@
+from dataclasses import dataclass
+from functools import cached_property
+
+import numpy as np
+
+from trialmatch_tool_evaluation.metrics.confusion import ConfusionCounts
+from trialmatch_tool_evaluation.ragged import (
+    lengths_to_offsets,
+    segment_ids,
+    segment_max,
+    segment_sum,
+)
+
+
+def fill_strategy(values, condition, strategy):
+    return np.where(condition, np.nan if strategy is None else strategy, values)
+
+
+def divide(numerator, denominator):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.asarray(numerator, dtype=float) / denominator
+
+
+@dataclass
+class MetricBatch:
+    ranking: np.ndarray
+    relevance: np.ndarray
+    offsets: np.ndarray
+    nb_all_trials_retrieved: np.ndarray | None = None
+    specific_relevance: np.ndarray | None = None
+    total_relevance: np.ndarray | None = None
+
+    @staticmethod
+    def from_lists(
+        ranking,
+        relevance=None,
+        nb_all_trials_retrieved=None,
+        specific_relevance=None,
+        total_relevance=None,
+    ):
+        def as_array(values):
+            return None if values is None else np.asarray(values, dtype=np.int64)
+
+        return MetricBatch(
+            ranking=as_array(ranking),
+            relevance=as_array(relevance),
+            offsets=lengths_to_offsets([len(ranking)]),
+            nb_all_trials_retrieved=as_array(
+                None if nb_all_trials_retrieved is None else [nb_all_trials_retrieved]
+            ),
+            specific_relevance=as_array(specific_relevance),
+            total_relevance=as_array(total_relevance),
+        )
+
+    @property
+    def nb_patients(self):
+        return len(self.offsets) - 1
+
+    @cached_property
+    def segment_ids(self):
+        return segment_ids(self.offsets)
+
+    @cached_property
+    def nb_relevant(self):
+        return self.count(self.relevance)
+
+    @cached_property
+    def ranking_sum(self):
+        return self.count(self.ranking)
+
+    @cached_property
+    def confusion(self):
+        return ConfusionCounts.from_ranking(self.ranking, self.relevance, self.offsets)
+
+    @cached_property
+    def max_rank(self):
+        return segment_max(self.ranking, self.offsets)
+
+    def relevance_at_rank(self, k_max):
+        # Relevance of the first trial found at each rank 0..k_max, per patient
+        width = k_max + 1
+        retrieved = np.flatnonzero((self.ranking > 0) & (self.ranking <= k_max))
+        cells = self.segment_ids[retrieved] * width + self.ranking[retrieved]
+
+        first = np.full(self.nb_patients * width, len(self.ranking))
+        np.minimum.at(first, cells, retrieved)
+        found = first < len(self.ranking)
+
+        relevance_at_rank = np.zeros(self.nb_patients * width)
+        relevance_at_rank[found] = self.relevance[first[found]]
+        return relevance_at_rank.reshape(self.nb_patients, width)
+
+    def count(self, values):
+        return segment_sum(values, self.offsets)
+
+    def tp_at(self, k):
+        return self.confusion.tp_at(k)
+
+    def fp_at(self, k):
+        return self.confusion.fp_at(k)
+
+    def fn_at(self, k):
+        return self.confusion.fn_at(k)
+
+    def tn_at(self, k, corpus_cardinality):
+        return self.confusion.tn_at(k, corpus_cardinality)
+
+    def patient_arguments(self, i):
+        pairs = slice(self.offsets[i], self.offsets[i + 1])
+
+        def as_list(values):
+            return None if values is None else values[pairs].tolist()
+
+        return {
+            "ranking": as_list(self.ranking),
+            "relevance": as_list(self.relevance),
+            "nb_all_trials_retrieved": (
+                None
+                if self.nb_all_trials_retrieved is None
+                else int(self.nb_all_trials_retrieved[i])
+            ),
+            "specific_relevance": as_list(self.specific_relevance),
+            "total_relevance": as_list(self.total_relevance),
+        }
@@ -1,12 +1,13 @@
+import numpy as np
+import pandas as pd
+
 from trialmatch_tool_evaluation.metrics.base_metrics import Metric
+from trialmatch_tool_evaluation.metrics.batch import divide
+from trialmatch_tool_evaluation.metrics.confusion import ConfusionCounts
 from trialmatch_tool_evaluation.metrics.ranked_metrics import (
-    FN_at_k,
-    FP_at_k,
     Precision_at_k,
     Sensitivity_at_k,
     Specificity_at_k,
-    TN_at_k,
-    TP_at_k,
 )
 
 
@@ -31,10 +32,11 @@ class TN(Metric):
         specific_relevance=None,
         total_relevance=None,
     ):
-        max_rank = get_max_rank(ranking)
+        confusion = ConfusionCounts.from_lists(ranking, relevance)
+        return int(confusion.tn_at(confusion.max_rank, self.corpus_cardinality)[0])
 
-        tn_at_max = TN_at_k(k=max_rank, corpus_cardinality=self.corpus_cardinality)
-        return tn_at_max.compute(ranking=ranking, relevance=relevance)
+    def compute_batch(self, batch):
+        return batch.tn_at(batch.max_rank, self.corpus_cardinality).astype(float)
 
 
 class TP(Metric):
@@ -48,10 +50,11 @@ class TP(Metric):
         specific_relevance=None,
         total_relevance=None,
     ):
-        max_rank = get_max_rank(ranking)
+        confusion = ConfusionCounts.from_lists(ranking, relevance)
+        return int(confusion.tp_at(confusion.max_rank)[0])
 
-        tp_at_max = TP_at_k(k=max_rank)
-        return tp_at_max.compute(ranking=ranking, relevance=relevance)
+    def compute_batch(self, batch):
+        return batch.tp_at(batch.max_rank).astype(float)
 
 
 class FP(Metric):
@@ -65,10 +68,11 @@ class FP(Metric):
         specific_relevance=None,
         total_relevance=None,
     ):
-        max_rank = get_max_rank(ranking)
+        confusion = ConfusionCounts.from_lists(ranking, relevance)
+        return int(confusion.fp_at(confusion.max_rank)[0])
 
-        fp_at_max = FP_at_k(k=max_rank)
-        return fp_at_max.compute(ranking=ranking, relevance=relevance)
+    def compute_batch(self, batch):
+        return batch.fp_at(batch.max_rank).astype(float)
 
 
 class FN(Metric):
@@ -82,10 +86,11 @@ class FN(Metric):
         specific_relevance=None,
         total_relevance=None,
     ):
-        max_rank = get_max_rank(ranking)
+        confusion = ConfusionCounts.from_lists(ranking, relevance)
+        return int(confusion.fn_at(confusion.max_rank)[0])
 
-        fn_at_max = FN_at_k(max_rank)
-        return fn_at_max.compute(ranking=ranking, relevance=relevance)
+    def compute_batch(self, batch):
+        return batch.fn_at(batch.max_rank).astype(float)
 
 
 class Precision(Metric):
@@ -107,6 +112,10 @@ class Precision(Metric):
         precision_at_max = Precision_at_k(max_rank, strategy=self.strategy)
         return precision_at_max.compute(ranking=ranking, relevance=relevance)
 
+    def compute_batch(self, batch):
+        precision_at_max = Precision_at_k(batch.max_rank, strategy=self.strategy)
+        return precision_at_max.compute_batch(batch)
+
 
 class Sensitivity(Metric):
     name = "Sensibility"
@@ -130,6 +139,10 @@ class Sensitivity(Metric):
         )
         return sensitivity_at_max.compute(ranking=ranking, relevance=relevance)
 
+    def compute_batch(self, batch):
+        sensitivity_at_max = Sensitivity_at_k(k=batch.max_rank, strategy=self.strategy)
+        return sensitivity_at_max.compute_batch(batch)
+
 
 class Specificity(Metric):
     name = "Specificity"
@@ -153,6 +166,13 @@ class Specificity(Metric):
         )
         return specificity_at_max.compute(ranking=ranking, relevance=relevance)
 
+    def compute_batch(self, batch):
+        specificity_at_max = Specificity_at_k(
+            k=batch.max_rank,
+            corpus_cardinality=self.corpus_cardinality,
+        )
+        return specificity_at_max.compute_batch(batch)
+
 
 class Accuracy(Metric):
     name = "Accuracy"
@@ -165,13 +185,23 @@ class Accuracy(Metric):
         specific_relevance=None,
         total_relevance=None,
     ):
-        tp = TP().compute(ranking, relevance)
-        fp = FP().compute(ranking, relevance)
-        fn = FN().compute(ranking, relevance)
-        tn = TN().compute(ranking, relevance)
+        confusion = ConfusionCounts.from_lists(ranking, relevance)
+        max_rank = confusion.max_rank
+        tp = int(confusion.tp_at(max_rank)[0])
+        fp = int(confusion.fp_at(max_rank)[0])
+        fn = int(confusion.fn_at(max_rank)[0])
+        tn = int(confusion.tn_at(max_rank, TN().corpus_cardinality)[0])
         value = (tp + tn) / (tp + fp + tn + fn)
         return value
 
+    def compute_batch(self, batch):
+        max_rank = batch.max_rank
+        tp = batch.tp_at(max_rank)
+        fp = batch.fp_at(max_rank)
+        fn = batch.fn_at(max_rank)
+        tn = batch.tn_at(max_rank, TN().corpus_cardinality)
+        return divide(tp + tn, tp + fp + tn + fn)
+
 
 class NbTrials(Metric):
     name = "NbTrials"
@@ -189,6 +219,9 @@ class NbTrials(Metric):
         value = max(ranking)
         return value
 
+    def compute_batch(self, batch):
+        return batch.max_rank.astype(float)
+
 
 class NbTrialsWhenNotZero(Metric):
     name = "NbTrialsWhenNotZero"
@@ -209,23 +242,32 @@ class NbTrialsWhenNotZero(Metric):
 
         return None
 
+    def compute_batch(self, batch):
+        return np.where(batch.max_rank != 0, batch.max_rank, np.nan)
+
 
 class PercentageOutOfCLBTrials(Metric):
     name = "PercentageOutOfCLBTrials"
 
     def compute(self, ranking, relevance, nct_ids, clb_open_nct_ids):
+        # clb_open_nct_ids is typically CLBTrialRegistry.nct_ids(criterium), looked
+        # up by hash
         tp = TP().compute(ranking, relevance)
         if tp == 0:
             return 0
-        nb_relevant_out_of_clb = 0
-        for i, trial in enumerate(nct_ids):
-            if (
-                (ranking[i] != 0)
-                and (relevance[i] == 1)
-                and (trial not in clb_open_nct_ids)
-            ):
-                nb_relevant_out_of_clb += 1
-        return nb_relevant_out_of_clb / tp
+        in_clb = pd.Index(clb_open_nct_ids).unique().get_indexer(nct_ids) >= 0
+        relevant_out_of_clb = (
+            (np.asarray(ranking) != 0) & (np.asarray(relevance) == 1) & ~in_clb
+        )
+        return int(relevant_out_of_clb.sum()) / tp
+
+    def compute_batch(self, batch, in_clb):
+        # in_clb flags the trials of batch.ranking that are CLB trials
+        tp = batch.tp_at(batch.max_rank)
+        out_of_clb = batch.count(
+            (batch.ranking != 0) & (batch.relevance == 1) & ~in_clb
+        )
+        return np.where(tp == 0, 0.0, divide(out_of_clb, tp))
 
 
 class NbErrors(Metric):
@@ -246,6 +288,9 @@ class NbErrors(Metric):
 
         return nb_errors
 
+    def compute_batch(self, batch):
+        return batch.count((batch.ranking != 0) & (batch.relevance == 0)).astype(float)
+
 
 class ErrorRate(Metric):
     name = "ErrorRate"
@@ -275,6 +320,16 @@ class ErrorRate(Metric):
 
         return nb_specific_errors / nb_total_errors
 
+    def compute_batch(self, batch):
+        retrieved = batch.ranking != 0
+        nb_total_errors = batch.count(retrieved & (batch.total_relevance == 0))
+        nb_specific_errors = batch.count(retrieved & (batch.specific_relevance == 0))
+
+        value = divide(nb_specific_errors, nb_total_errors)
+        return np.where(
+            (batch.ranking_sum == 0) | (nb_total_errors == 0), np.nan, value
+        )
+
 
 class NbTotalTreatmentLines(Metric):
     name = "NbTotalTreatmentLines"
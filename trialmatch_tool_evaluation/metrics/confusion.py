@@ -0,0 +1,95 @@
+from dataclasses import dataclass
+
+import numpy as np
+
+from trialmatch_tool_evaluation.ragged import (
+    lengths_to_offsets,
+    segment_ids,
+    segment_max,
+    segment_sum,
+)
+
+
+def _cumulative(mask):
+    cumulative = np.zeros(len(mask) + 1, dtype=np.int64)
+    np.cumsum(mask, out=cumulative[1:])
+    return cumulative
+
+
+@dataclass
+class ConfusionCounts:
+    # Retrieved trials sorted by (patient, rank) with running TP/FP counts, so the
+    # counts at any cut-off are a binary search in the patient's segment and memory
+    # follows the number of retrieved trials, not patients x max rank
+    keys: np.ndarray
+    tp_cumulative: np.ndarray
+    fp_cumulative: np.ndarray
+    stride: int
+    nb_relevant: np.ndarray
+    max_rank: np.ndarray
+
+    @staticmethod
+    def from_ranking(ranking, relevance, offsets):
+        max_rank = segment_max(ranking, offsets)
+        stride = int(max_rank.max(initial=0)) + 1
+
+        retrieved = np.flatnonzero(ranking > 0)
+        keys = segment_ids(offsets)[retrieved] * stride + ranking[retrieved]
+        order = np.argsort(keys, kind="stable")
+        retrieved_relevance = relevance[retrieved][order]
+
+        return ConfusionCounts(
+            keys=keys[order],
+            tp_cumulative=_cumulative(retrieved_relevance == 1),
+            fp_cumulative=_cumulative(retrieved_relevance == 0),
+            stride=stride,
+            nb_relevant=segment_sum(relevance == 1, offsets),
+            max_rank=max_rank,
+        )
+
+    @staticmethod
+    def from_lists(ranking, relevance):
+        return ConfusionCounts.from_ranking(
+            np.asarray(ranking, dtype=np.int64),
+            np.asarray(relevance, dtype=np.int64),
+            lengths_to_offsets([len(ranking)]),
+        )
+
+    def _count(self, cumulative, patients, k):
+        # Retrieved trials of each patient ranked at most k
+        first = patients * self.stride
+        start = np.searchsorted(self.keys, first, side="right")
+        stop = np.searchsorted(
+            self.keys, first + np.clip(k, 0, self.stride - 1), side="right"
+        )
+        return cumulative[stop] - cumulative[start]
+
+    def _at(self, cumulative, k):
+        # k is a cut-off shared by every patient or one cut-off per patient
+        return self._count(cumulative, np.arange(len(self.max_rank)), k)
+
+    def _curve(self, cumulative, k_values):
+        # One column per cut-off
+        patients = np.arange(len(self.max_rank))[:, None]
+        return self._count(cumulative, patients, np.asarray(k_values)[None, :])
+
+    def tp_curve(self, k_values):
+        return self._curve(self.tp_cumulative, k_values)
+
+    def fp_curve(self, k_values):
+        return self._curve(self.fp_cumulative, k_values)
+
+    def fn_curve(self, k_values):
+        return self.nb_relevant[:, None] - self.tp_curve(k_values)
+
+    def tp_at(self, k):
+        return self._at(self.tp_cumulative, k)
+
+    def fp_at(self, k):
+        return self._at(self.fp_cumulative, k)
+
+    def fn_at(self, k):
+        return self.nb_relevant - self.tp_at(k)
+
+    def tn_at(self, k, corpus_cardinality):
+        return corpus_cardinality - self.tp_at(k) - self.fp_at(k) - self.fn_at(k)
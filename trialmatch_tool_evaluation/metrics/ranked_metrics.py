@@ -1,7 +1,11 @@
 import math
 
+import numpy as np
+
 from trialmatch_tool_evaluation.constants import CORPUS_CARDINALITY
 from trialmatch_tool_evaluation.metrics.base_metrics import RankedMetric
+from trialmatch_tool_evaluation.metrics.batch import MetricBatch, divide, fill_strategy
+from trialmatch_tool_evaluation.metrics.confusion import ConfusionCounts
 
 
 class FN_at_k(RankedMetric):
@@ -18,14 +22,11 @@ class FN_at_k(RankedMetric):
         specific_relevance=None,
         total_relevance=None,
     ):
-        value = len(
-            [
-                i
-                for i in range(len(relevance))
-                if (ranking[i] == 0 or ranking[i] > self.k) and relevance[i] == 1
-            ]
-        )
-        return value
+        confusion = ConfusionCounts.from_lists(ranking, relevance)
+        return int(confusion.fn_at(self.k)[0])
+
+    def compute_batch(self, batch):
+        return batch.fn_at(self.k).astype(float)
 
 
 class TP_at_k(RankedMetric):
@@ -42,14 +43,11 @@ class TP_at_k(RankedMetric):
         specific_relevance=None,
         total_relevance=None,
     ):
-        value = len(
-            [
-                i
-                for i in range(len(relevance))
-                if ranking[i] > 0 and ranking[i] <= self.k and relevance[i] == 1
-            ]
-        )
-        return value
+        confusion = ConfusionCounts.from_lists(ranking, relevance)
+        return int(confusion.tp_at(self.k)[0])
+
+    def compute_batch(self, batch):
+        return batch.tp_at(self.k).astype(float)
 
 
 class FP_at_k(RankedMetric):
@@ -66,14 +64,11 @@ class FP_at_k(RankedMetric):
         specific_relevance=None,
         total_relevance=None,
     ):
-        value = len(
-            [
-                i
-                for i in range(len(relevance))
-                if ranking[i] > 0 and ranking[i] <= self.k and relevance[i] == 0
-            ]
-        )
-        return value
+        confusion = ConfusionCounts.from_lists(ranking, relevance)
+        return int(confusion.fp_at(self.k)[0])
+
+    def compute_batch(self, batch):
+        return batch.fp_at(self.k).astype(float)
 
 
 class TN_at_k(RankedMetric):
@@ -94,12 +89,11 @@ class TN_at_k(RankedMetric):
         specific_relevance=None,
         total_relevance=None,
     ):
-        tp = TP_at_k(k=self.k).compute(ranking, relevance)
-        fp = FP_at_k(k=self.k).compute(ranking, relevance)
-        fn = FN_at_k(k=self.k).compute(ranking, relevance)
+        confusion = ConfusionCounts.from_lists(ranking, relevance)
+        return int(confusion.tn_at(self.k, self.corpus_cardinality)[0])
 
-        value = self.corpus_cardinality - tp - fp - fn
-        return value
+    def compute_batch(self, batch):
+        return batch.tn_at(self.k, self.corpus_cardinality).astype(float)
 
 
 class Precision_at_k(RankedMetric):
@@ -123,12 +117,28 @@ class Precision_at_k(RankedMetric):
         if sum(ranking) == 0:
             return 0.0
 
-        tp = TP_at_k(k=self.k).compute(ranking, relevance)
-        fp = FP_at_k(k=self.k).compute(ranking, relevance)
+        confusion = ConfusionCounts.from_lists(ranking, relevance)
+        tp = int(confusion.tp_at(self.k)[0])
+        fp = int(confusion.fp_at(self.k)[0])
         value = tp / (tp + fp)
 
         return value
 
+    def compute_batch(self, batch):
+        tp = batch.tp_at(self.k)
+        fp = batch.fp_at(self.k)
+        value = np.where(batch.ranking_sum == 0, 0.0, divide(tp, tp + fp))
+
+        return fill_strategy(value, batch.nb_relevant == 0, self.strategy)
+
+    def compute_curve(self, batch, k_max):
+        k_values = np.arange(1, k_max + 1)
+        tp = batch.confusion.tp_curve(k_values)
+        fp = batch.confusion.fp_curve(k_values)
+        value = np.where(batch.ranking_sum[:, None] == 0, 0.0, divide(tp, tp + fp))
+
+        return fill_strategy(value, batch.nb_relevant[:, None] == 0, self.strategy)
+
 
 class Sensitivity_at_k(RankedMetric):
     generic_name = "Sensibility@{k}"
@@ -148,12 +158,28 @@ class Sensitivity_at_k(RankedMetric):
         if sum(relevance) == 0:
             return self.strategy
 
-        tp = TP_at_k(k=self.k).compute(ranking, relevance)
-        fn = FN_at_k(k=self.k).compute(ranking, relevance)
+        confusion = ConfusionCounts.from_lists(ranking, relevance)
+        tp = int(confusion.tp_at(self.k)[0])
+        fn = int(confusion.fn_at(self.k)[0])
 
         value = tp / (tp + fn)
         return value
 
+    def compute_batch(self, batch):
+        tp = batch.tp_at(self.k)
+        fn = batch.fn_at(self.k)
+        value = divide(tp, tp + fn)
+
+        return fill_strategy(value, batch.nb_relevant == 0, self.strategy)
+
+    def compute_curve(self, batch, k_max):
+        k_values = np.arange(1, k_max + 1)
+        tp = batch.confusion.tp_curve(k_values)
+        fn = batch.confusion.fn_curve(k_values)
+        value = divide(tp, tp + fn)
+
+        return fill_strategy(value, batch.nb_relevant[:, None] == 0, self.strategy)
+
 
 class Specificity_at_k(RankedMetric):
     name = "Specificity@k"
@@ -170,13 +196,18 @@ class Specificity_at_k(RankedMetric):
         specific_relevance=None,
         total_relevance=None,
     ):
-        tp = TP_at_k(k=self.k).compute(ranking, relevance)
-        fp = FP_at_k(k=self.k).compute(ranking, relevance)
-        fn = FN_at_k(k=self.k).compute(ranking, relevance)
-        tn = self.corpus_cardinality - tp - fn - fp
+        confusion = ConfusionCounts.from_lists(ranking, relevance)
+        fp = int(confusion.fp_at(self.k)[0])
+        tn = int(confusion.tn_at(self.k, self.corpus_cardinality)[0])
 
         return tn / (tn + fp)
 
+    def compute_batch(self, batch):
+        fp = batch.fp_at(self.k)
+        tn = batch.tn_at(self.k, self.corpus_cardinality)
+
+        return divide(tn, tn + fp)
+
 
 class AP_at_k(RankedMetric):
     generic_name = "AP@{k}"
@@ -199,20 +230,35 @@ class AP_at_k(RankedMetric):
         if sum(ranking) == 0:
             return 0.0
 
-        precisions_sum = 0
-        nb_relevant = 0
-        for i in range(1, min(self.k, max(ranking)) + 1):
-            prec = Precision_at_k(k=i, strategy=self.strategy).compute(
-                ranking, relevance
-            )
-            rel = relevance[ranking.index(i)]
-            nb_relevant += rel
-            precisions_sum += prec * rel
+        batch = MetricBatch.from_lists(ranking, relevance)
+        return float(self.compute_batch(batch)[0])
 
-        if nb_relevant == 0:
-            return precisions_sum
+    def compute_batch(self, batch):
+        return self.compute_curve(batch, self.k)[:, -1]
 
-        return precisions_sum / nb_relevant
+    def compute_curve(self, batch, k_max):
+        confusion = batch.confusion
+        ranks = np.arange(1, min(k_max, confusion.stride - 1) + 1)
+
+        # Precision at every rank, kept only where the trial at that rank is relevant
+        tp = confusion.tp_curve(ranks)
+        precision = divide(tp, tp + confusion.fp_curve(ranks))
+        rel_at_rank = batch.relevance_at_rank(len(ranks))[:, ranks]
+        precisions = np.where(rel_at_rank != 0, precision * rel_at_rank, 0.0)
+
+        # Sequential sums in rank order, one column per cut-off
+        precisions_sum = np.zeros((batch.nb_patients, k_max))
+        nb_relevant = np.zeros((batch.nb_patients, k_max))
+        if len(ranks) > 0:
+            columns = np.minimum(np.arange(k_max), len(ranks) - 1)
+            precisions_sum = np.cumsum(precisions, axis=1)[:, columns]
+            nb_relevant = np.cumsum(rel_at_rank, axis=1)[:, columns]
+
+        value = np.where(
+            nb_relevant == 0, precisions_sum, divide(precisions_sum, nb_relevant)
+        )
+        value = np.where(batch.ranking_sum[:, None] == 0, 0.0, value)
+        return fill_strategy(value, batch.nb_relevant[:, None] == 0, self.strategy)
 
 
 class NDCG_at_k(RankedMetric):
@@ -260,6 +306,50 @@ class NDCG_at_k(RankedMetric):
 
         return value
 
+    def gains(self, batch):
+        max_rank = int(batch.ranking.max(initial=0))
+        discounts = np.array([1.0] + [self.discount(r) for r in range(1, max_rank + 1)])
+        return np.where(
+            (batch.ranking != 0) & (batch.relevance != 0),
+            batch.relevance / discounts[batch.ranking],
+            0.0,
+        )
+
+    def ideal_dcg(self, k, nb_relevant):
+        ideal_size = np.maximum(1, np.minimum(k, nb_relevant))
+        ideal_dcgs = [0]
+        for i in range(1, int(ideal_size.max(initial=1)) + 1):
+            ideal_dcgs.append(ideal_dcgs[-1] + 1 / self.discount(i))
+        return np.array(ideal_dcgs)[ideal_size]
+
+    def compute_batch(self, batch):
+        gains = self.gains(batch)
+        sum_dcg = batch.count(np.where(batch.ranking <= self.k, gains, 0.0))
+        ideal_dcg = self.ideal_dcg(self.k, batch.nb_relevant)
+
+        value = np.where(sum_dcg == 0, 0.0, divide(sum_dcg, ideal_dcg))
+        value = np.where(batch.ranking_sum == 0, 0.0, value)
+        return fill_strategy(value, batch.nb_relevant == 0, self.strategy)
+
+    def compute_curve(self, batch, k_max):
+        k_values = np.arange(1, k_max + 1)
+        width = min(k_max, int(batch.max_rank.max(initial=0))) + 1
+
+        # DCG accumulated in rank order up to k_max, one column per cut-off
+        retrieved = (batch.ranking > 0) & (batch.ranking < width)
+        cells = batch.segment_ids[retrieved] * width + batch.ranking[retrieved]
+        gain_at_rank = np.bincount(
+            cells,
+            weights=self.gains(batch)[retrieved],
+            minlength=batch.nb_patients * width,
+        ).reshape(batch.nb_patients, width)
+        sum_dcg = np.cumsum(gain_at_rank, axis=1)[:, np.minimum(k_values, width - 1)]
+        ideal_dcg = self.ideal_dcg(k_values[None, :], batch.nb_relevant[:, None])
+
+        value = np.where(sum_dcg == 0, 0.0, divide(sum_dcg, ideal_dcg))
+        value = np.where(batch.ranking_sum[:, None] == 0, 0.0, value)
+        return fill_strategy(value, batch.nb_relevant[:, None] == 0, self.strategy)
+
 
 class NFPR_at_k(RankedMetric):
     generic_name = "NFPR@{k}"
@@ -270,9 +360,10 @@ class NFPR_at_k(RankedMetric):
         self.strategy = strategy
 
     def false_positive_rate(self, ranking, relevance):
-        tp = TP_at_k(k=self.k).compute(ranking, relevance)
-        fp = FP_at_k(k=self.k).compute(ranking, relevance)
-        fn = FN_at_k(k=self.k).compute(ranking, relevance)
+        confusion = ConfusionCounts.from_lists(ranking, relevance)
+        tp = int(confusion.tp_at(self.k)[0])
+        fp = int(confusion.fp_at(self.k)[0])
+        fn = int(confusion.fn_at(self.k)[0])
 
         return fp / (self.corpus_cardinality - tp - fn)
 
@@ -289,3 +380,22 @@ class NFPR_at_k(RankedMetric):
         value = fpr / worst_score
 
         return value
+
+    def compute_batch(self, batch):
+        tp = batch.tp_at(self.k)
+        fp = batch.fp_at(self.k)
+        fn = batch.fn_at(self.k)
+
+        fpr = divide(fp, self.corpus_cardinality - tp - fn)
+        worst_score = self.k / (self.corpus_cardinality - self.k)
+        return fpr / worst_score
+
+    def compute_curve(self, batch, k_max):
+        k_values = np.arange(1, k_max + 1)
+        tp = batch.confusion.tp_curve(k_values)
+        fp = batch.confusion.fp_curve(k_values)
+        fn = batch.confusion.fn_curve(k_values)
+
+        fpr = divide(fp, self.corpus_cardinality - tp - fn)
+        worst_score = k_values / (self.corpus_cardinality - k_values)
+        return fpr / worst_score
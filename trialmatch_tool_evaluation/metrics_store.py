@@ -0,0 +1,171 @@
+from dataclasses import dataclass
+from functools import cached_property
+
+import numpy as np
+import pandas as pd
+
+KEY_COLUMNS = ["metric_name", "criterium", "tool", "patient_id"]
+
+
+def _encode(values, categories):
+    # Code of each value in the sorted categories, -1 when absent
+    if len(categories) == 0:
+        return np.full(len(values), -1, dtype=np.int32)
+    codes = np.minimum(np.searchsorted(categories, values), len(categories) - 1)
+    return np.where(categories[codes] == values, codes, -1).astype(np.int32)
+
+
+@dataclass
+class MetricsStore:
+    # Long metrics table with integer-coded keys over sorted categories
+    codes: dict
+    categories: dict
+    value: np.ndarray
+
+    @staticmethod
+    def from_blocks(blocks, metric_names, patient_ids):
+        # blocks: (criterium, tool, scores) with one row per patient and one
+        # column per metric, laid out patient-major like the long table
+        metric_names = np.asarray(metric_names, dtype=str)
+        patient_ids = np.asarray(patient_ids, dtype=str)
+        criteria = np.array([criterium for criterium, _, _ in blocks], dtype=str)
+        tools = np.array([tool for _, tool, _ in blocks], dtype=str)
+
+        categories = {
+            "metric_name": np.unique(metric_names),
+            "criterium": np.unique(criteria),
+            "tool": np.unique(tools),
+            "patient_id": np.unique(patient_ids),
+        }
+        block_size = len(patient_ids) * len(metric_names)
+        codes = {
+            "metric_name": np.tile(
+                _encode(metric_names, categories["metric_name"]),
+                len(patient_ids) * len(blocks),
+            ),
+            "criterium": np.repeat(
+                _encode(criteria, categories["criterium"]), block_size
+            ),
+            "tool": np.repeat(_encode(tools, categories["tool"]), block_size),
+            "patient_id": np.tile(
+                np.repeat(
+                    _encode(patient_ids, categories["patient_id"]), len(metric_names)
+                ),
+                len(blocks),
+            ),
+        }
+        value = np.concatenate(
+            [np.asarray(scores, dtype=np.float64).ravel() for _, _, scores in blocks]
+            or [np.empty(0)]
+        )
+        return MetricsStore(codes=codes, categories=categories, value=value)
+
+    @staticmethod
+    def from_frame(df_metrics: pd.DataFrame):
+        codes, categories = {}, {}
+        for column in KEY_COLUMNS:
+            keys = df_metrics[column]
+            if isinstance(keys.dtype, pd.CategoricalDtype):
+                categories[column] = np.asarray(keys.cat.categories, dtype=str)
+                codes[column] = keys.cat.codes.to_numpy(dtype=np.int32)
+            else:
+                categories[column] = np.unique(keys.to_numpy(dtype=str))
+                codes[column] = _encode(keys.to_numpy(dtype=str), categories[column])
+        value = df_metrics["value"].to_numpy(dtype=np.float64, na_value=np.nan)
+        return MetricsStore(codes=codes, categories=categories, value=value)
+
+    @staticmethod
+    def load(path):
+        with np.load(path) as arrays:
+            return MetricsStore(
+                codes={column: arrays[f"{column}.codes"] for column in KEY_COLUMNS},
+                categories={
+                    column: arrays[f"{column}.categories"] for column in KEY_COLUMNS
+                },
+                value=arrays["value"],
+            )
+
+    def save(self, path):
+        np.savez(
+            path,
+            value=self.value,
+            **{f"{column}.codes": self.codes[column] for column in KEY_COLUMNS},
+            **{
+                f"{column}.categories": self.categories[column]
+                for column in KEY_COLUMNS
+            },
+        )
+
+    def __len__(self):
+        return len(self.value)
+
+    @cached_property
+    def valid(self):
+        return ~np.isnan(self.value)
+
+    def mask(self, **keys):
+        # e.g. store.mask(metric_name="AP@3", tool="Klineo")
+        mask = np.ones(len(self), dtype=bool)
+        for column, value in keys.items():
+            code = _encode(np.array([value], dtype=str), self.categories[column])[0]
+            mask &= self.codes[column] == code
+        return mask
+
+    def scores(self, criterium, tool, metric_names, patient_ids):
+        # Patients x metrics matrix, NaN where the store holds no score
+        mask = self.mask(criterium=criterium, tool=tool)
+        metric_codes = _encode(
+            np.asarray(metric_names, dtype=str), self.categories["metric_name"]
+        )
+        patient_codes = _encode(
+            np.asarray(patient_ids, dtype=str), self.categories["patient_id"]
+        )
+
+        metric_position = np.full(len(self.categories["metric_name"]), -1)
+        metric_position[metric_codes[metric_codes >= 0]] = np.flatnonzero(
+            metric_codes >= 0
+        )
+        patient_position = np.full(len(self.categories["patient_id"]), -1)
+        patient_position[patient_codes[patient_codes >= 0]] = np.flatnonzero(
+            patient_codes >= 0
+        )
+
+        rows = patient_position[self.codes["patient_id"][mask]]
+        columns = metric_position[self.codes["metric_name"][mask]]
+        kept = (rows >= 0) & (columns >= 0)
+
+        scores = np.full((len(patient_ids), len(metric_names)), np.nan)
+        scores[rows[kept], columns[kept]] = self.value[mask][kept]
+        return scores, int(kept.sum())
+
+    def matrix(self):
+        # Patients (rows) x (metric_name, criterium, tool) groups (columns)
+        group_columns = ["metric_name", "criterium", "tool"]
+        groups, group_codes = np.unique(
+            np.column_stack([self.codes[column] for column in group_columns]),
+            axis=0,
+            return_inverse=True,
+        )
+        values = np.full((len(self.categories["patient_id"]), len(groups)), np.nan)
+        values[self.codes["patient_id"], group_codes.ravel()] = self.value
+        keys = [
+            tuple(
+                str(self.categories[column][code])
+                for column, code in zip(group_columns, group)
+            )
+            for group in groups
+        ]
+        return values, keys
+
+    def to_frame(self):
+        return pd.DataFrame(
+            {
+                **{
+                    column: pd.Categorical.from_codes(
+                        self.codes[column], categories=self.categories[column]
+                    )
+                    for column in KEY_COLUMNS
+                },
+                "value": self.value,
+            }
+        )
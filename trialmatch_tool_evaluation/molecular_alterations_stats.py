@@ -1,11 +1,14 @@
 import statistics
+from dataclasses import dataclass
 
+import numpy as np
 import pandas as pd
 import plotly.express as px
+from scipy import sparse
 
-from trialmatch_tool_evaluation import PLOTS_FOLDER
+from trialmatch_tool_evaluation import ALTERATION_COOCCURRENCE_PATH, PLOTS_FOLDER
 from trialmatch_tool_evaluation.constants import PLOT_COLORS
-from trialmatch_tool_evaluation.patient_data import PatientData
+from trialmatch_tool_evaluation.rendering import write_image
 
 
 def get_patient_alterations(genes_string):
@@ -15,21 +18,80 @@ def get_patient_alterations(genes_string):
         return genes_string.split(" and ")
 
 
-def plot_total_alterations(df_alterations):
-
-    unique_alterations = df_alterations["alteration"].unique()
-    frequency, text = [], []
-    for alt in unique_alterations:
-        freq = len(df_alterations[df_alterations["alteration"] == alt])
-        frequency.append(freq)
-        rate = round(freq / len(unique_alterations) * 100, 1)
-        text.append(f"{freq} ({rate} %)")
+@dataclass
+class AlterationIncidence:
+    # Sparse patient x alteration matrix of occurrence counts, with patients and
+    # alterations in order of first appearance
+    counts: sparse.csr_matrix
+    patient_ids: np.ndarray
+    alterations: np.ndarray
+
+    @staticmethod
+    def from_formatted_data(formatted_data: pd.DataFrame):
+        patient_ids, alterations = [], []
+        for patient_id, genes in zip(
+            formatted_data["patient_id"], formatted_data["genes"]
+        ):
+            for alteration in get_patient_alterations(genes):
+                patient_ids.append(patient_id)
+                alterations.append(alteration)
+
+        patient_codes, unique_patients = pd.factorize(pd.Series(patient_ids))
+        alteration_codes, unique_alterations = pd.factorize(
+            pd.Series(alterations, dtype=object)
+        )
+        # Duplicated (patient, alteration) entries are summed
+        counts = sparse.csr_matrix(
+            (
+                np.ones(len(alterations), dtype=np.int64),
+                (patient_codes, alteration_codes),
+            ),
+            shape=(len(unique_patients), len(unique_alterations)),
+        )
+        return AlterationIncidence(
+            counts=counts,
+            patient_ids=np.asarray(unique_patients),
+            alterations=np.asarray(unique_alterations, dtype=object),
+        )
+
+    @property
+    def nb_alterations(self):
+        return int(self.counts.sum())
+
+    def total_frequency(self):
+        return np.asarray(self.counts.sum(axis=0)).ravel()
+
+    def patient_frequency(self):
+        return self.counts.getnnz(axis=0)
+
+    def alterations_per_patient(self):
+        return np.asarray(self.counts.sum(axis=1)).ravel()
+
+    def cooccurrence(self):
+        # Number of patients sharing each pair of alterations
+        presence = (self.counts > 0).astype(np.int64)
+        return (presence.T @ presence).tocoo()
+
+    def cooccurrence_table(self):
+        cooccurrence = self.cooccurrence()
+        pairs = cooccurrence.row < cooccurrence.col
+        return pd.DataFrame(
+            {
+                "alteration_1": self.alterations[cooccurrence.row[pairs]],
+                "alteration_2": self.alterations[cooccurrence.col[pairs]],
+                "nb_patients": cooccurrence.data[pairs],
+            }
+        ).sort_values(
+            by=["nb_patients", "alteration_1", "alteration_2"],
+            ascending=[False, True, True],
+        )
+
+
+def plot_alteration_frequencies(alterations, frequency, total, title):
+    frequency = frequency.tolist()
+    text = [f"{freq} ({round(freq / total * 100, 1)} %)" for freq in frequency]
     alt_stats = pd.DataFrame(
-        {
-            "Alteration": unique_alterations,
-            "Frequency": frequency,
-            "text": text,
-        }
+        {"Alteration": alterations, "Frequency": frequency, "text": text}
     )
     alt_stats = alt_stats.sort_values(by="Frequency", ascending=False).iloc[:12]
 
@@ -43,81 +105,48 @@ def plot_total_alterations(df_alterations):
         text="text",
         color="Alteration",
         orientation="h",
-        title="12 most frequent molecular alterations",
+        title=title,
         color_discrete_map=colors,
     )
-    fig.write_image(PLOTS_FOLDER / "molecular_alterations.png")
-
-
-def plot_patient_level_alterations(df_alterations):
+    return fig
 
-    unique_patients = df_alterations["patient_id"].unique()
-    unique_alterations = df_alterations["alteration"].unique()
 
-    frequency, text = [], []
-
-    for alt in unique_alterations:
-        freq = 0
-        for p in unique_patients:
-            if (
-                alt
-                in df_alterations[df_alterations["patient_id"] == p][
-                    "alteration"
-                ].tolist()
-            ):
-                freq += 1
-        frequency.append(freq)
-        rate = round(freq / len(unique_patients) * 100, 1)
-        text.append(f"{freq} ({rate} %)")
-
-    alt_stats = pd.DataFrame(
-        {"Alteration": unique_alterations, "Frequency": frequency, "text": text}
+def plot_total_alterations(incidence: AlterationIncidence):
+    # Rates are relative to the number of distinct alterations
+    fig = plot_alteration_frequencies(
+        incidence.alterations,
+        incidence.total_frequency(),
+        len(incidence.alterations),
+        "12 most frequent molecular alterations",
     )
-    alt_stats = alt_stats.sort_values(by="Frequency", ascending=False).iloc[:12]
+    write_image(fig, PLOTS_FOLDER / "molecular_alterations.png")
 
-    colors = {
-        alt_stats["Alteration"].iloc[k]: PLOT_COLORS[k] for k in range(len(alt_stats))
-    }
-    fig = px.bar(
-        alt_stats.sort_values(by="Frequency", ascending=False),
-        x="Frequency",
-        y="Alteration",
-        text="text",
-        color="Alteration",
-        orientation="h",
-        title="12 most frequent molecular alterations (rate over patients)",
-        color_discrete_map=colors,
+
+def plot_patient_level_alterations(incidence: AlterationIncidence):
+    fig = plot_alteration_frequencies(
+        incidence.alterations,
+        incidence.patient_frequency(),
+        len(incidence.patient_ids),
+        "12 most frequent molecular alterations (rate over patients)",
     )
     fig.update_xaxes(title_text="Number of patients")
-    fig.write_image(PLOTS_FOLDER / "molecular_alterations_patient_level.png")
+    write_image(fig, PLOTS_FOLDER / "molecular_alterations_patient_level.png")
 
 
 def main(formatted_data: pd.DataFrame):
     PLOTS_FOLDER.mkdir(exist_ok=True)
 
     # Find patients molecular alterations
-    data = {"patient_id": [], "alteration": []}
-
-    for _, patient_values in formatted_data.iterrows():
-        patient_data = PatientData.from_ranking(patient_values.to_dict())
-        alterations = get_patient_alterations(patient_data.genes)
-
-        for alteration in alterations:
-            data["patient_id"].append(patient_data.patient_id)
-            data["alteration"].append(alteration)
-
-    df_alterations = pd.DataFrame(data)
-    print("Total number of alterations : ", len(df_alterations))
+    incidence = AlterationIncidence.from_formatted_data(formatted_data)
+    print("Total number of alterations : ", incidence.nb_alterations)
 
     # Plot alterations rate
-    plot_total_alterations(df_alterations)
-    plot_patient_level_alterations(df_alterations)
+    plot_total_alterations(incidence)
+    plot_patient_level_alterations(incidence)
+    incidence.cooccurrence_table().to_csv(ALTERATION_COOCCURRENCE_PATH, index=False)
 
     # Compute mean number of alterations per patient
-    unique_patients = df_alterations["patient_id"].unique()
-    nb_alterations = []
-    for p in unique_patients:
-        nb_alterations.append(len(df_alterations[df_alterations["patient_id"] == p]))
+    nb_alterations = incidence.alterations_per_patient().tolist()
     mean = round(statistics.mean(nb_alterations), 2)
     std = round(statistics.stdev(nb_alterations), 2)
     print(f"Mean number of alterations per patient : {mean} (sd {std})")
@@ -1,25 +1,34 @@
 from dataclasses import dataclass
 
+import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
 
 from trialmatch_tool_evaluation import FORMATTED_CSV_PATH, PLOTS_FOLDER
-from trialmatch_tool_evaluation._utils import (
-    append_metrics_dict,
-    dfi_export_proxy,
-    get_clb_clinical_trials_file,
+from trialmatch_tool_evaluation._utils import dfi_export_proxy, extend_metrics_dict
+from trialmatch_tool_evaluation.clb_registry import (
+    CLBTrialRegistry,
+    get_clb_trial_registry,
 )
+from trialmatch_tool_evaluation.cohort import Cohort
 from trialmatch_tool_evaluation.constants import (
     CRITERIA,
     PLOT_COLORS,
     TrialMatchingTools,
 )
 from trialmatch_tool_evaluation.metrics import (
+    MetricBatch,
     NbTrials,
     NbTrialsWhenNotZero,
     PercentageOutOfCLBTrials,
 )
+from trialmatch_tool_evaluation.parallel import (
+    concatenate_shards,
+    map_shards,
+    sum_shards,
+)
 from trialmatch_tool_evaluation.preprocess_files import get_formatted_data
+from trialmatch_tool_evaluation.rendering import write_image
 
 
 def plot_nb_trials_hist(df_nb_trials):
@@ -46,20 +55,7 @@ def plot_nb_trials_hist(df_nb_trials):
         bargap=0.15,
         bargroupgap=0.05,
     )
-    fig.write_image(PLOTS_FOLDER / "nb_trials_histogram.png")
-
-
-def preprocess_clb_clinical_trials(criterium="eligibility_and_status"):
-    df_clb_clinical_trials = get_clb_clinical_trials_file()
-    if criterium != "eligibility":
-        df_clb_clinical_trials = df_clb_clinical_trials[
-            df_clb_clinical_trials["STATUT_RECRUTEMENT"] == "Ouverte aux inclusions"
-        ]
-    df_clb_clinical_trials = df_clb_clinical_trials[
-        df_clb_clinical_trials["VALEUR"].str.contains("NCT")
-    ]
-    clb_open_nct_ids = df_clb_clinical_trials["VALEUR"].unique()
-    return clb_open_nct_ids
+    write_image(fig, PLOTS_FOLDER / "nb_trials_histogram.png")
 
 
 @dataclass
@@ -130,22 +126,21 @@ class PatientTrialAnnotationCount:
         return self.eligibile_on_status + self.noteligibile_on_status
 
 
-def get_trial_location_count(relevant_nct_ids, clb_open_nct_ids, current_metric):
-    only_relevant_trials_outside_clb = len(relevant_nct_ids) > 0 and set(
-        relevant_nct_ids
-    ).isdisjoint(set(clb_open_nct_ids))
-    only_relevant_trials_inside_clb = len(relevant_nct_ids) > 0 and (
-        len(set(relevant_nct_ids) - set(clb_open_nct_ids)) == 0
-    )
+TRIALS_LOCATIONS = ["None", "Only in CLB", "Only outside CLB", "Both"]
+COUNTING_METRICS = [NbTrials(), NbTrialsWhenNotZero()]
 
-    if len(relevant_nct_ids) == 0:
-        current_metric["None"] += 1
-    elif only_relevant_trials_outside_clb:
-        current_metric["Only outside CLB"] += 1
-    elif only_relevant_trials_inside_clb:
-        current_metric["Only in CLB"] += 1
-    else:
-        current_metric["Both"] += 1
+
+def get_trial_locations(nb_relevant, nb_relevant_in_clb):
+    # Index in TRIALS_LOCATIONS of each patient, from its relevant trials
+    return np.select(
+        [
+            nb_relevant == 0,
+            nb_relevant_in_clb == nb_relevant,
+            nb_relevant_in_clb == 0,
+        ],
+        [0, 1, 2],
+        default=3,
+    )
 
 
 def append_trial_location(metrics_dict, current_metric, tool, criterium):
@@ -156,11 +151,59 @@ def append_trial_location(metrics_dict, current_metric, tool, criterium):
         metrics_dict["value"].append(metric_value)
 
 
-def main(formatted_data: pd.DataFrame):
+def compute_nb_trials(cohort: Cohort):
+    nb_trials = {}
+    for tool in TrialMatchingTools.all():
+        batch = MetricBatch(
+            ranking=cohort.rankings[tool], relevance=None, offsets=cohort.offsets
+        )
+        nb_trials[tool] = np.column_stack(
+            [metric.compute_batch(batch) for metric in COUNTING_METRICS]
+        )
+    return nb_trials
+
+
+def compute_out_of_clb_trials(cohort: Cohort, registry: CLBTrialRegistry):
+    out_of_clb_trials = {}
+    for criterium in CRITERIA:
+        in_clb = registry.mask(cohort.trials, criterium)[cohort.nct_code]
+        for tool in TrialMatchingTools.all():
+            batch = MetricBatch(
+                ranking=cohort.rankings[tool],
+                relevance=cohort.relevance(criterium),
+                offsets=cohort.offsets,
+            )
+            scores = PercentageOutOfCLBTrials().compute_batch(batch, in_clb)
+            out_of_clb_trials[(criterium, tool)] = scores[:, None]
+    return out_of_clb_trials
+
+
+def compute_trials_locations(cohort: Cohort, registry: CLBTrialRegistry):
+    trials_locations = {}
+    for criterium in CRITERIA:
+        relevance = cohort.relevance(criterium) == 1
+        in_clb = registry.mask(cohort.trials, criterium)[cohort.nct_code]
+        retrieved = {
+            **{tool: cohort.rankings[tool] > 0 for tool in TrialMatchingTools.all()},
+            "all": True,
+        }
+        for tool, retrieved_by_tool in retrieved.items():
+            relevant = relevance & retrieved_by_tool
+            locations = get_trial_locations(
+                cohort.segment_sum(relevant), cohort.segment_sum(relevant & in_clb)
+            )
+            counts = np.bincount(locations, minlength=len(TRIALS_LOCATIONS))
+            for location, count in zip(TRIALS_LOCATIONS, counts.tolist()):
+                trials_locations[(criterium, tool, location)] = count
+    return trials_locations
+
+
+def main(formatted_data: pd.DataFrame, workers: int = 1):
 
     # ---------------------------------------- Nb trials ----------------------------------------
 
-    nb_all_trials_retrieved = len(set(sum(formatted_data["nct_id"], [])))
+    cohort = Cohort.from_formatted_data(formatted_data)
+    nb_all_trials_retrieved = len(cohort.unique_trials())
     print("\nTotal number of clinical trials : ", nb_all_trials_retrieved)
 
     nb_trials_dict = {
@@ -170,23 +213,16 @@ def main(formatted_data: pd.DataFrame):
         "value": [],
     }
 
-    counting_metrics = [NbTrials(), NbTrialsWhenNotZero()]
+    nb_trials = concatenate_shards(map_shards(compute_nb_trials, cohort, workers))
 
     for tool in TrialMatchingTools.all():
-
-        for _, patient_row in formatted_data.iterrows():
-            ranking = patient_row[tool]
-
-            for metric in counting_metrics:
-                current_score = metric.compute(ranking=ranking)
-
-                append_metrics_dict(
-                    metrics_dict=nb_trials_dict,
-                    metric=metric,
-                    score=current_score,
-                    patient_id=patient_row["patient_id"],
-                    tool=tool,
-                )
+        extend_metrics_dict(
+            metrics_dict=nb_trials_dict,
+            metrics=COUNTING_METRICS,
+            scores=nb_trials[tool],
+            patient_ids=cohort.patient_id,
+            tool=tool,
+        )
 
     df_nb_trials = pd.DataFrame(nb_trials_dict)
 
@@ -255,27 +291,26 @@ def main(formatted_data: pd.DataFrame):
         "value": [],
     }
 
+    registry = get_clb_trial_registry()
+    out_of_clb_trials = concatenate_shards(
+        map_shards(
+            compute_out_of_clb_trials,
+            cohort,
+            workers,
+            registry=registry,
+        )
+    )
+
     for criterium in CRITERIA:
-        clb_open_nct_ids = preprocess_clb_clinical_trials(criterium=criterium)
         for tool in TrialMatchingTools.all():
-            for _, patient_row in formatted_data.iterrows():
-                patient_id = patient_row["patient_id"]
-                ranking = patient_row[tool]
-                relevance = patient_row[criterium]
-                nct_ids = patient_row["nct_id"]
-
-                nb_out_of_clb_relevant_trials = PercentageOutOfCLBTrials().compute(
-                    ranking, relevance, nct_ids, clb_open_nct_ids
-                )
-
-                append_metrics_dict(
-                    metrics_dict=nb_out_of_clb_trials_dict,
-                    metric=PercentageOutOfCLBTrials,
-                    score=nb_out_of_clb_relevant_trials,
-                    criterium=criterium,
-                    tool=tool,
-                    patient_id=patient_id,
-                )
+            extend_metrics_dict(
+                metrics_dict=nb_out_of_clb_trials_dict,
+                metrics=[PercentageOutOfCLBTrials],
+                scores=out_of_clb_trials[(criterium, tool)],
+                criterium=criterium,
+                tool=tool,
+                patient_ids=cohort.patient_id,
+            )
 
     df_nb_out_of_clb_trials = pd.DataFrame(nb_out_of_clb_trials_dict)
 
@@ -302,54 +337,27 @@ def main(formatted_data: pd.DataFrame):
         "value": [],
     }
 
-    trials_locations_patient_count = {
-        "None": 0,
-        "Only in CLB": 0,
-        "Only outside CLB": 0,
-        "Both": 0,
-    }
+    trials_locations = sum_shards(
+        map_shards(
+            compute_trials_locations,
+            cohort,
+            workers,
+            registry=registry,
+        )
+    )
 
     for criterium in CRITERIA:
-        clb_open_nct_ids = preprocess_clb_clinical_trials(criterium=criterium)
-        for tool in TrialMatchingTools.all():
-            current_metric = trials_locations_patient_count.copy()
-            for _, patient_row in formatted_data.iterrows():
-                rankings = patient_row[tool]
-                relevances = patient_row[criterium]
-                nct_ids = patient_row["nct_id"]
-
-                relevant_nct_ids = [
-                    nct_id
-                    for nct_id, relevance, rank in zip(nct_ids, relevances, rankings)
-                    if relevance == 1 and rank > 0
-                ]
-                get_trial_location_count(
-                    relevant_nct_ids, clb_open_nct_ids, current_metric
-                )
-
+        for tool in TrialMatchingTools.all() + ["all"]:
             append_trial_location(
                 nb_patient_depending_on_trials_locations,
-                current_metric,
+                {
+                    location: trials_locations[(criterium, tool, location)]
+                    for location in TRIALS_LOCATIONS
+                },
                 tool,
                 criterium,
             )
 
-        current_metric = trials_locations_patient_count.copy()
-        for _, patient_row in formatted_data.iterrows():
-            relevances = patient_row[criterium]
-            nct_ids = patient_row["nct_id"]
-
-            relevant_nct_ids = [
-                nct_id
-                for nct_id, relevance in zip(nct_ids, relevances)
-                if relevance == 1
-            ]
-            get_trial_location_count(relevant_nct_ids, clb_open_nct_ids, current_metric)
-
-        append_trial_location(
-            nb_patient_depending_on_trials_locations, current_metric, "all", criterium
-        )
-
     nb_patient_depending_on_trials_locations_aggregations = pd.DataFrame(
         nb_patient_depending_on_trials_locations
     )
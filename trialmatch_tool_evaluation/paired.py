@@ -0,0 +1,23 @@
+import itertools
+
+import numpy as np
+
+from trialmatch_tool_evaluation.constants import TrialMatchingTools
+
+
+def paired_differences(values, keys):
+    # Every tool pair of each (metric, criterium), on patients scored for both
+    columns = {key: i for i, key in enumerate(keys)}
+    differences, difference_keys = [], []
+    for metric, criterium in dict.fromkeys(key[:2] for key in keys):
+        for tool_a, tool_b in itertools.combinations(TrialMatchingTools.all(), 2):
+            column_a = columns.get((metric, criterium, tool_a))
+            column_b = columns.get((metric, criterium, tool_b))
+            if column_a is None or column_b is None:
+                continue
+            differences.append(values[:, column_a] - values[:, column_b])
+            difference_keys.append((metric, criterium, tool_a, tool_b))
+
+    if not differences:
+        return np.empty((len(values), 0)), difference_keys
+    return np.column_stack(differences), difference_keys
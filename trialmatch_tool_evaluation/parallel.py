@@ -0,0 +1,51 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import partial
+from itertools import chain
+
+import numpy as np
+
+from trialmatch_tool_evaluation.cohort import Cohort
+
+
+def map_shards(function, cohort: Cohort, workers: int = 1, **kwargs):
+    # One result per contiguous patient shard, returned in patient order
+    shards = cohort.split(workers)
+    if len(shards) <= 1:
+        return [function(cohort, **kwargs)]
+
+    with ProcessPoolExecutor(max_workers=len(shards)) as executor:
+        return list(executor.map(partial(function, **kwargs), shards))
+
+
+def imap_shards(function, cohort: Cohort, workers: int = 1, **kwargs):
+    # Yields (patient slice, result) as shards complete, so each result can be
+    # reduced and dropped instead of holding every shard
+    patient_slices = cohort.shard_slices(workers)
+    if len(patient_slices) <= 1:
+        yield slice(0, cohort.nb_patients), function(cohort, **kwargs)
+        return
+
+    with ProcessPoolExecutor(max_workers=len(patient_slices)) as executor:
+        futures = {
+            executor.submit(function, cohort.take(patients), **kwargs): patients
+            for patients in patient_slices
+        }
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+
+def concatenate_shards(shard_results):
+    merged = {}
+    for key, first in shard_results[0].items():
+        parts = [result[key] for result in shard_results]
+        if isinstance(first, list):
+            merged[key] = list(chain.from_iterable(parts))
+        else:
+            merged[key] = np.concatenate(parts)
+    return merged
+
+
+def sum_shards(shard_results):
+    return {
+        key: sum(result[key] for result in shard_results) for key in shard_results[0]
+    }
@@ -0,0 +1,88 @@
+import numpy as np
+import pandas as pd
+
+from trialmatch_tool_evaluation import METRICS_STORE_PATH
+from trialmatch_tool_evaluation.constants import (
+    EXACT_PERMUTATION_MAX_PATIENTS,
+    NB_PERMUTATIONS,
+    RANDOM_SEED,
+)
+from trialmatch_tool_evaluation.metrics_store import MetricsStore
+from trialmatch_tool_evaluation.paired import paired_differences
+
+# Sign flips are drawn and applied in chunks of about this many (flip, patient) cells
+FLIP_CELLS_PER_CHUNK = 2**22
+
+
+def random_sign_flips(nb_flips, nb_patients, rng):
+    # int8 signs, one flip per row
+    signs = rng.integers(0, 2, size=(nb_flips, nb_patients), dtype=np.int8)
+    return 1 - 2 * signs
+
+
+def count_extreme_flips(values, threshold, nb_flips, seed):
+    # Flips whose absolute sum reaches the threshold, per column, with one set of
+    # flips shared by all columns and never more than a chunk of them in memory
+    rng = np.random.default_rng(seed)
+    chunk_size = max(1, FLIP_CELLS_PER_CHUNK // max(len(values), 1))
+    extreme = np.zeros(values.shape[1], dtype=np.int64)
+    for start in range(0, nb_flips, chunk_size):
+        flips = random_sign_flips(min(chunk_size, nb_flips - start), len(values), rng)
+        extreme += (np.abs(flips @ values) >= threshold).sum(axis=0)
+    return extreme
+
+
+def all_sign_flips(nb_patients):
+    # Every sign pattern, one per row (2 ** nb_patients x nb_patients)
+    patterns = (np.arange(2**nb_patients)[:, None] >> np.arange(nb_patients)) & 1
+    return 1.0 - 2.0 * patterns
+
+
+def permutation_p_values(differences, nb_permutations, seed, exact_max_patients):
+    # Two-sided paired sign-flip test of a zero mean difference, per column.
+    # Missing and zero differences are unchanged by any flip, so they are set to 0
+    # and the statistic reduces to the sum of the differences.
+    values = np.nan_to_num(differences, nan=0.0)
+    observed = np.abs(values.sum(axis=0))
+    # Relative tolerance, so the observed pattern always counts as extreme
+    tolerance = np.maximum(1e-14, 1e-14 * observed)
+
+    # Monte-Carlo p-values
+    extreme = count_extreme_flips(values, observed - tolerance, nb_permutations, seed)
+    p_values = (extreme + 1) / (nb_permutations + 1)
+
+    # Exact p-values where few patients have a non-zero difference
+    nb_nonzero = (values != 0).sum(axis=0)
+    for nb_patients in np.unique(nb_nonzero[nb_nonzero <= exact_max_patients]):
+        columns = np.flatnonzero(nb_nonzero == nb_patients)
+        order = np.argsort(values[:, columns] == 0, axis=0, kind="stable")
+        nonzero = np.take_along_axis(values[:, columns], order, axis=0)[:nb_patients]
+
+        flipped = np.abs(all_sign_flips(nb_patients) @ nonzero)
+        extreme = (flipped >= observed[columns] - tolerance[columns]).sum(axis=0)
+        p_values[columns] = extreme / 2**nb_patients
+
+    return p_values
+
+
+def main(
+    df_metrics: pd.DataFrame,
+    nb_permutations: int = NB_PERMUTATIONS,
+    seed: int = RANDOM_SEED,
+    exact_max_patients: int = EXACT_PERMUTATION_MAX_PATIENTS,
+):
+    values, keys = MetricsStore.from_frame(df_metrics).matrix()
+    differences, difference_keys = paired_differences(values, keys)
+
+    return pd.DataFrame(
+        difference_keys, columns=["metric", "criterium", "tool_1", "tool_2"]
+    ).assign(
+        permutation_p_value=permutation_p_values(
+            differences, nb_permutations, seed, exact_max_patients
+        )
+    )
+
+
+if __name__ == "__main__":
+    df_metrics = MetricsStore.load(METRICS_STORE_PATH).to_frame()
+    print(main(df_metrics))
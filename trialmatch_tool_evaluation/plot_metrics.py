@@ -1,22 +1,34 @@
 import pandas as pd
 import plotly.express as px
 
-from trialmatch_tool_evaluation import PLOTS_FOLDER
+from trialmatch_tool_evaluation import DIFF_FROM_MEDIAN_PATH, PLOTS_FOLDER
 from trialmatch_tool_evaluation.metrics import FN, FP, TN, TP
+from trialmatch_tool_evaluation.rendering import write_image
 
 
-def plot_difference_from_median(df, df_median):
+def get_difference_from_median(df_metrics: pd.DataFrame):
+    # One row per df_metrics row, next to the patient's median over the tools
+    keys = ["metric_name", "criterium", "patient_id"]
+    df_median_over_tools = (
+        df_metrics[df_metrics["tool"] != "all"]
+        .groupby(keys, observed=True)["value"]
+        .median()
+        .rename("median_over_tools")
+        .reset_index()
+    )
+    df_diff = df_metrics.merge(df_median_over_tools, on=keys, how="left")
+    df_diff["diff_from_median"] = df_diff["value"] - df_diff["median_over_tools"]
+    return df_diff
+
+
+def plot_difference_from_median(df):
 
     criterium = df["criterium"].iloc[0]
     metric = df["metric_name"].iloc[0]
     tool = df["tool"].iloc[0]
 
-    df["median_over_tools"] = df["patient_id"].apply(
-        lambda x: df_median[df_median["patient_id"] == x]["median"].iloc[0]
-    )
-    df = df.assign(diff_from_median=df["value"] - df["median_over_tools"])
     df = df.dropna()
-    df["patient_id"] = df["patient_id"].apply(lambda x: str(x))
+    df = df.assign(patient_id=df["patient_id"].apply(lambda x: str(x)))
 
     fig = px.bar(
         df,
@@ -35,7 +47,7 @@ def plot_difference_from_median(df, df_median):
         / "diff_from_median"
         / f"{metric}_diff_from_median_{criterium}_{tool}.png"
     )
-    fig.write_image(img_path)
+    write_image(fig, img_path)
 
 
 def plot_confusion_matrix(data, criterium, tool):
@@ -51,7 +63,7 @@ def plot_confusion_matrix(data, criterium, tool):
     img_path = (
         PLOTS_FOLDER / "confusion_matrices" / f"confusion_matrix_{criterium}_{tool}.png"
     )
-    fig.write_image(img_path)
+    write_image(fig, img_path)
 
 
 def init_folders():
@@ -64,23 +76,13 @@ def main(df_metrics: pd.DataFrame, df_aggregation_metrics: pd.DataFrame):
 
     # --------------------------------- Plot difference from median ---------------------------------
 
-    df_median_over_tools = (
-        df_metrics[df_metrics["tool"] != "all"]
-        .groupby(["metric_name", "criterium", "patient_id"])["value"]
-        .agg(["median"])
-        .reset_index()
-    )
+    df_diff = get_difference_from_median(df_metrics)
+    df_diff.to_csv(DIFF_FROM_MEDIAN_PATH, index=False)
 
-    for group_name, group_values in df_metrics.groupby(
-        ["criterium", "metric_name", "tool"]
+    for _, group_values in df_diff.groupby(
+        ["criterium", "metric_name", "tool"], observed=True
     ):
-        criterium = group_name[0]
-        metric = group_name[1]
-        subset_median_over_tools = df_median_over_tools[
-            (df_median_over_tools["criterium"] == criterium)
-            & (df_median_over_tools["metric_name"] == metric)
-        ]
-        plot_difference_from_median(group_values, subset_median_over_tools)
+        plot_difference_from_median(group_values)
 
     # ----------------------------------- PLot confusion matrices -----------------------------------
 
@@ -1,19 +1,140 @@
+import hashlib
+import os
+import zipfile
 from ast import literal_eval
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
 
+SCALAR_COLUMNS = {"patient_id", "genes", "tumor_type"}
+CACHE_SUFFIX = ".cache.npz"
+FINGERPRINT_KEYS = ["size", "mtime_ns", "sha256"]
 
-def get_formatted_data(formatted_csv_path: Path):
+
+def get_cache_path(formatted_csv_path: Path):
+    return formatted_csv_path.with_suffix(CACHE_SUFFIX)
+
+
+def get_source_fingerprint(formatted_csv_path: Path):
+    file_hash = hashlib.sha256()
+    with open(formatted_csv_path, "rb") as source_file:
+        for chunk in iter(lambda: source_file.read(1 << 20), b""):
+            file_hash.update(chunk)
+
+    stat = formatted_csv_path.stat()
+    return {
+        "size": str(stat.st_size),
+        "mtime_ns": str(stat.st_mtime_ns),
+        "sha256": file_hash.hexdigest(),
+    }
+
+
+def parse_formatted_data(formatted_csv_path: Path):
     rankings = pd.read_csv(formatted_csv_path)
-    for column in set(rankings.columns) - {
-        "patient_id",
-        "genes",
-        "tumor_type",
-    }:
+    for column in set(rankings.columns) - SCALAR_COLUMNS:
         rankings[column] = rankings[column].apply(
             lambda x: literal_eval(x) if x is not None else None
         )
 
     rankings.loc[rankings["genes"].isna(), "genes"] = None
     return rankings
+
+
+def _pack_values(values: list):
+    if all(type(v) is int for v in values):
+        return {"values": np.array(values, dtype=np.int64)}
+
+    if all(type(v) in (int, float) for v in values):
+        return {"values": np.array(values, dtype=np.float64)}
+
+    if all(v is None or isinstance(v, str) for v in values):
+        mask = np.array([v is None for v in values], dtype=bool)
+        strings = np.array(["" if v is None else v for v in values], dtype=str)
+        return {"values": strings, "mask": mask}
+
+    raise TypeError("Cannot cache values of mixed types.")
+
+
+def _unpack_values(arrays: dict):
+    values = arrays["values"].tolist()
+    if "mask" in arrays:
+        values = [None if m else v for v, m in zip(values, arrays["mask"].tolist())]
+    return values
+
+
+def pack_formatted_data(formatted_data: pd.DataFrame):
+    arrays = {"__columns__": np.array(formatted_data.columns, dtype=str)}
+    for column in formatted_data.columns:
+        cells = formatted_data[column].tolist()
+        if column in SCALAR_COLUMNS:
+            packed = _pack_values(cells)
+        else:
+            packed = _pack_values([v for cell in cells for v in cell])
+            packed["offsets"] = np.concatenate(
+                [[0], np.cumsum([len(cell) for cell in cells])]
+            ).astype(np.int64)
+        for name, array in packed.items():
+            arrays[f"{column}.{name}"] = array
+    return arrays
+
+
+def unpack_formatted_data(arrays):
+    data = {}
+    for column in arrays["__columns__"].tolist():
+        packed = {
+            name: arrays[f"{column}.{name}"]
+            for name in ["values", "mask", "offsets"]
+            if f"{column}.{name}" in arrays
+        }
+        values = _unpack_values(packed)
+        if "offsets" in packed:
+            offsets = packed["offsets"].tolist()
+            values = [values[a:b] for a, b in zip(offsets[:-1], offsets[1:])]
+            data[column] = pd.Series(values, dtype=object)
+        else:
+            data[column] = pd.Series(values)
+    return pd.DataFrame(data)
+
+
+def read_formatted_data_cache(cache_path: Path, fingerprint: dict):
+    try:
+        with np.load(cache_path, allow_pickle=False) as arrays:
+            for key in FINGERPRINT_KEYS:
+                if arrays[f"__{key}__"].item() != fingerprint[key]:
+                    return None
+            return unpack_formatted_data(arrays)
+    except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+        return None
+
+
+def write_formatted_data_cache(
+    cache_path: Path, formatted_data: pd.DataFrame, fingerprint: dict
+):
+    arrays = pack_formatted_data(formatted_data)
+    for key in FINGERPRINT_KEYS:
+        arrays[f"__{key}__"] = np.array(fingerprint[key])
+
+    tmp_path = cache_path.with_name(cache_path.name + ".tmp")
+    with open(tmp_path, "wb") as cache_file:
+        np.savez(cache_file, **arrays)
+    os.replace(tmp_path, cache_path)
+
+
+def get_formatted_data(formatted_csv_path: Path, use_cache: bool = True):
+    if not use_cache:
+        return parse_formatted_data(formatted_csv_path)
+
+    cache_path = get_cache_path(formatted_csv_path)
+    fingerprint = get_source_fingerprint(formatted_csv_path)
+
+    formatted_data = read_formatted_data_cache(cache_path, fingerprint)
+    if formatted_data is None:
+        formatted_data = parse_formatted_data(formatted_csv_path)
+        try:
+            write_formatted_data_cache(cache_path, formatted_data, fingerprint)
+        except TypeError:
+            # Columns that cannot be stored as typed arrays are parsed on every run
+            pass
+
+    return formatted_data
@@ -0,0 +1,31 @@
+import numpy as np
+
+
+def lengths_to_offsets(lengths):
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return offsets
+
+
+def segment_ids(offsets):
+    return np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+
+
+def segment_sum(values, offsets):
+    values = np.asarray(values)
+    if values.dtype.kind in "biu":
+        cumulative = np.zeros(len(values) + 1, dtype=np.int64)
+        np.cumsum(values, out=cumulative[1:])
+        return cumulative[offsets[1:]] - cumulative[offsets[:-1]]
+
+    # bincount adds each segment in array order, as the builtin sum does
+    return np.bincount(segment_ids(offsets), weights=values, minlength=len(offsets) - 1)
+
+
+def segment_max(values, offsets, initial=0):
+    values = np.asarray(values)
+    result = np.full(len(offsets) - 1, initial, dtype=values.dtype)
+    starts = offsets[:-1][offsets[1:] > offsets[:-1]]
+    if len(starts) > 0:
+        result[offsets[1:] > offsets[:-1]] = np.maximum.reduceat(values, starts)
+    return result
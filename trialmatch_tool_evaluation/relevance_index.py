@@ -0,0 +1,32 @@
+from dataclasses import dataclass
+
+import numpy as np
+
+from trialmatch_tool_evaluation.cohort import Cohort
+
+
+@dataclass
+class RelevanceIndex:
+    eligibility: np.ndarray
+    status: np.ndarray
+    union: np.ndarray
+    intersection: np.ndarray
+
+    @staticmethod
+    def from_cohort(cohort: Cohort):
+        return RelevanceIndex(
+            eligibility=cohort.eligibility,
+            status=cohort.status,
+            union=np.maximum(cohort.eligibility, cohort.status),
+            intersection=np.minimum(cohort.eligibility, cohort.status),
+        )
+
+    def total_relevance(self):
+        return self.intersection
+
+    def specific_relevance(self, criterium):
+        if criterium == "eligibility_and_status":
+            return self.union
+        if criterium in ["eligibility", "status"]:
+            return getattr(self, criterium)
+        raise ValueError("Unknown criteria.")
@@ -0,0 +1,105 @@
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+
+from trialmatch_tool_evaluation.artifact_cache import (
+    artifact_key,
+    is_cached,
+    record_artifact,
+)
+
+# Queue collecting figures while a render_queue block is active
+_active_queue = None
+
+
+def _render(figure, path):
+    # Kaleido keeps its browser process alive between calls, so every worker
+    # renders all of its figures on the same warm instance
+    import plotly.io as pio
+
+    pio.write_image(figure, path)
+    return path
+
+
+def _show_progress(done, total):
+    if sys.stdout.isatty():
+        print(f"Rendered {done}/{total} plots", end="\r", flush=True)
+
+
+class RenderQueue:
+    def __init__(self, workers: int = 1):
+        self.workers = workers
+        self.jobs = []
+
+    def add(self, fig, path, key):
+        # Figures are queued as plain dicts so they pickle cheaply to the workers
+        self.jobs.append((fig.to_dict(), str(path), key))
+
+    def render(self):
+        jobs, self.jobs = self.jobs, []
+        if not jobs:
+            return
+
+        if self.workers <= 1:
+            for done, (figure, path, key) in enumerate(jobs, start=1):
+                _render(figure, path)
+                record_artifact(path, key)
+                _show_progress(done, len(jobs))
+        else:
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                futures = {
+                    executor.submit(_render, figure, path): key
+                    for figure, path, key in jobs
+                }
+                for done, future in enumerate(as_completed(futures), start=1):
+                    record_artifact(future.result(), futures[future])
+                    _show_progress(done, len(jobs))
+        # Terminals end on the counter's last value, logs get one summary line
+        if sys.stdout.isatty():
+            print()
+        else:
+            print(f"Rendered {len(jobs)} plots")
+
+
+@contextmanager
+def render_queue(workers: int = 1):
+    # Plotly exports inside the block are deferred and rendered together on exit
+    global _active_queue
+    previous, _active_queue = _active_queue, RenderQueue(workers)
+    try:
+        yield _active_queue
+        _active_queue.render()
+    finally:
+        _active_queue = previous
+
+
+@contextmanager
+def collect_renders():
+    # Plotly exports inside the block are queued and handed back unrendered
+    global _active_queue
+    previous, _active_queue = _active_queue, RenderQueue()
+    try:
+        yield _active_queue.jobs
+    finally:
+        _active_queue = previous
+
+
+def add_renders(jobs):
+    # Renders collected elsewhere join the active queue, or are rendered right away
+    queue = _active_queue or RenderQueue()
+    queue.jobs.extend(jobs)
+    if queue is not _active_queue:
+        queue.render()
+
+
+def write_image(fig, path):
+    # Figures whose content matches the last export of path are not re-rendered
+    key = artifact_key(fig)
+    if is_cached(path, key):
+        return
+
+    if _active_queue is None:
+        fig.write_image(path)
+        record_artifact(path, key)
+    else:
+        _active_queue.add(fig, path, key)
@@ -0,0 +1,101 @@
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import dataclass
+from importlib import import_module
+from time import perf_counter
+from typing import Any, Tuple
+
+from trialmatch_tool_evaluation.artifact_cache import collect_records, update_manifest
+from trialmatch_tool_evaluation.rendering import add_renders, collect_renders
+
+
+@dataclass(frozen=True)
+class Stage:
+    name: str
+    # "module:function", imported only when the stage runs
+    function: str
+    inputs: Tuple[str, ...] = ()
+    outputs: Tuple[str, ...] = ()
+    # Run options (e.g. workers) forwarded to the function as keyword arguments
+    options: Tuple[str, ...] = ()
+    # Fixed keyword arguments as (name, value) pairs, so stages stay hashable
+    arguments: Tuple[Tuple[str, Any], ...] = ()
+
+    def load_function(self):
+        module_name, function_name = self.function.split(":")
+        return getattr(import_module(module_name), function_name)
+
+
+def select_stages(stages, only=None, skip=None):
+    return [
+        stage
+        for stage in stages
+        if (not only or stage.name in only) and stage.name not in (skip or [])
+    ]
+
+
+def _call_stage(stage: Stage, inputs: dict, options: dict):
+    result = stage.load_function()(
+        **inputs,
+        **dict(stage.arguments),
+        **{option: options[option] for option in stage.options},
+    )
+    if len(stage.outputs) == 1:
+        result = (result,)
+    return dict(zip(stage.outputs, result)) if stage.outputs else {}
+
+
+def _run_in_process(stage: Stage, inputs: dict, options: dict):
+    # Plots and manifest entries go back to the parent, which owns both
+    start = perf_counter()
+    with collect_renders() as renders, collect_records() as records:
+        outputs = _call_stage(stage, inputs, options)
+    return outputs, renders, records, perf_counter() - start
+
+
+def run_stages(stages, loaders: dict, options: dict, workers: int = 1):
+    # Inputs not produced by a selected stage are loaded from the previous run
+    produced = {output for stage in stages for output in stage.outputs}
+    values = {
+        name: loaders[name]()
+        for name in {name for stage in stages for name in stage.inputs} - produced
+    }
+    timings = {}
+
+    # A single stage keeps every worker for its own patient shards
+    if workers <= 1 or len(stages) == 1:
+        # Stages are listed in dependency order
+        for stage in stages:
+            print(f"Running stage {stage.name} ...")
+            start = perf_counter()
+            inputs = {name: values[name] for name in stage.inputs}
+            values.update(_call_stage(stage, inputs, options))
+            timings[stage.name] = perf_counter() - start
+            print(f"Stage {stage.name} done in {timings[stage.name]:.1f}s")
+        return timings
+
+    # Stages already run one per process, so they do not start pools of their own
+    pool_options = {**options, "workers": 1}
+    pending = list(stages)
+    running = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        while pending or running:
+            for stage in [s for s in pending if set(s.inputs) <= values.keys()]:
+                print(f"Running stage {stage.name} ...")
+                inputs = {name: values[name] for name in stage.inputs}
+                future = executor.submit(_run_in_process, stage, inputs, pool_options)
+                running[future] = stage
+                pending.remove(stage)
+
+            if not running:
+                missing = {name for s in pending for name in s.inputs} - values.keys()
+                raise ValueError(f"No stage produces {sorted(missing)}")
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage = running.pop(future)
+                outputs, renders, records, timings[stage.name] = future.result()
+                values.update(outputs)
+                add_renders(renders)
+                update_manifest(records)
+                print(f"Stage {stage.name} done in {timings[stage.name]:.1f}s")
+    return timings
@@ -8,7 +8,15 @@ from scipy import stats
 
 from trialmatch_tool_evaluation import PLOTS_FOLDER, RESULTS_FOLDER
 from trialmatch_tool_evaluation._utils import dfi_export_proxy
+from trialmatch_tool_evaluation.artifact_cache import (
+    artifact_key,
+    is_cached,
+    record_artifact,
+)
 from trialmatch_tool_evaluation.constants import TrialMatchingTools
+from trialmatch_tool_evaluation.permutation_tests import (
+    main as compute_permutation_tests,
+)
 
 TTEST_PATH = RESULTS_FOLDER / f"t_test_results.csv"
 TTEST_FOLDER = PLOTS_FOLDER / f"t_tests"
@@ -46,37 +54,22 @@ def main(df_metrics: pd.DataFrame):
     ttest_results = []
 
     for group_name, group_values in df_without_error_rate.groupby(
-        ["metric_name", "criterium"]
+        ["metric_name", "criterium"], observed=True
     ):
         metric = group_name[0]
         criterium = group_name[1]
 
         tool_values = {}
-        for tool, values in group_values.groupby("tool"):
+        for tool, values in group_values.groupby("tool", observed=True):
             tool_values[tool] = values.dropna(subset="value").reset_index(drop=True)
 
-        current_group_df = group_values.dropna(subset="value").reset_index(drop=True)
-        ax = plt.axes()
-        sns.boxplot(
-            data=current_group_df,
-            y="value",
-            x="tool",
-            hue="tool",
-        ).set(title=f"{metric} on {criterium}", xlabel="tool", ylabel=f"{metric}")
-
-        y_min = ax.get_ylim()[0]
-        y_max = ax.get_ylim()[1]
-
-        ax.set(ylim=(y_min, y_max * 1.5))
-
+        group_results = []
         for tool_a, tool_b in tool_combinations:
             tool_a_scores = tool_values[tool_a]["value"].tolist()
             tool_b_scores = tool_values[tool_b]["value"].tolist()
 
             test_results = run_t_test(tool_a_scores, tool_b_scores)
-
-            current_comparison_name = f"{tool_a}_VS_{tool_b}"
-            ttest_results.append(
+            group_results.append(
                 {
                     "metric": metric,
                     "criterium": criterium,
@@ -85,9 +78,36 @@ def main(df_metrics: pd.DataFrame):
                 }
                 | test_results
             )
+        ttest_results.extend(group_results)
+
+        current_group_df = group_values.dropna(subset="value").reset_index(drop=True)
+        boxplot_path = BOXPLOT_PATH / f"{metric}-{criterium}.png"
+        boxplot_key = artifact_key(
+            current_group_df[["tool", "value"]],
+            [get_bracket_name(result["p_value"]) for result in group_results],
+        )
+        if is_cached(boxplot_path, boxplot_key):
+            continue
+
+        ax = plt.axes()
+        sns.boxplot(
+            data=current_group_df,
+            y="value",
+            x="tool",
+            hue="tool",
+            order=TrialMatchingTools.all(),
+            hue_order=TrialMatchingTools.all(),
+        ).set(title=f"{metric} on {criterium}", xlabel="tool", ylabel=f"{metric}")
 
+        y_min = ax.get_ylim()[0]
+        y_max = ax.get_ylim()[1]
+
+        ax.set(ylim=(y_min, y_max * 1.5))
+
+        for result in group_results:
+            current_comparison_name = f"{result['tool_1']}_VS_{result['tool_2']}"
             ax.annotate(
-                text=get_bracket_name(test_results["p_value"]),
+                text=get_bracket_name(result["p_value"]),
                 xy=brackets_dict[current_comparison_name]["xy"],
                 xytext=brackets_dict[current_comparison_name]["xytext"],
                 xycoords="axes fraction",
@@ -100,16 +120,29 @@ def main(df_metrics: pd.DataFrame):
                 ),
             )
 
-        plt.savefig(BOXPLOT_PATH / f"{metric}-{criterium}.png")
+        plt.savefig(boxplot_path)
         plt.close()
-
-    # Save results as csv
-    df_t_tests = pd.DataFrame(ttest_results)
+        record_artifact(boxplot_path, boxplot_key)
+
+    # Save results as csv, with the paired permutation test p-values
+    df_t_tests = pd.DataFrame(ttest_results).merge(
+        compute_permutation_tests(df_metrics),
+        on=["metric", "criterium", "tool_1", "tool_2"],
+        how="left",
+    )
     df_t_tests.to_csv(TTEST_PATH, index=False)
 
     for metric, ttest_by_metric in df_t_tests.groupby("metric"):
         dfi_export_proxy(
-            ttest_by_metric.round({"inf": 3, "mean": 3, "sup": 3, "p_value": 5}),
+            ttest_by_metric.round(
+                {
+                    "inf": 3,
+                    "mean": 3,
+                    "sup": 3,
+                    "p_value": 5,
+                    "permutation_p_value": 5,
+                }
+            ),
             TTEST_FOLDER / f"t_test_results_for_{metric}.png",
         )
 
@@ -0,0 +1,164 @@
+import numpy as np
+import pandas as pd
+
+from trialmatch_tool_evaluation import (
+    FORMATTED_CSV_PATH,
+    METRICS_STORE_PATH,
+    STRATIFIED_METRICS_PATH,
+)
+from trialmatch_tool_evaluation.metrics_store import MetricsStore
+from trialmatch_tool_evaluation.molecular_alterations_stats import AlterationIncidence
+from trialmatch_tool_evaluation.preprocess_files import get_formatted_data
+from trialmatch_tool_evaluation.ragged import lengths_to_offsets, segment_sum
+
+
+def get_patient_strata(formatted_data: pd.DataFrame, patient_categories):
+    # Every patient is in the "all" stratum, its tumor type stratum and one
+    # stratum per altered gene. Returns the strata and the (patient code,
+    # stratum code) memberships
+    tumor_type_codes, tumor_types = pd.factorize(formatted_data["tumor_type"])
+    incidence = AlterationIncidence.from_formatted_data(formatted_data)
+    gene_members = incidence.counts.tocoo()
+
+    strata = pd.DataFrame(
+        {
+            "stratum_type": ["all"]
+            + ["tumor_type"] * len(tumor_types)
+            + ["gene"] * len(incidence.alterations),
+            "stratum": ["all"] + list(tumor_types) + list(incidence.alterations),
+        }
+    )
+
+    patient_index = pd.Index(patient_categories)
+    tumor_patients = patient_index.get_indexer(
+        formatted_data["patient_id"].to_numpy(dtype=str)
+    )
+    gene_patients = patient_index.get_indexer(
+        np.asarray(incidence.patient_ids, dtype=str)
+    )[gene_members.row]
+    has_tumor_type = tumor_type_codes >= 0
+
+    member_patient = np.concatenate(
+        [
+            np.arange(len(patient_categories)),
+            tumor_patients[has_tumor_type],
+            gene_patients,
+        ]
+    )
+    member_stratum = np.concatenate(
+        [
+            np.zeros(len(patient_categories), dtype=np.int64),
+            1 + tumor_type_codes[has_tumor_type],
+            1 + len(tumor_types) + gene_members.col,
+        ]
+    )
+    kept = member_patient >= 0
+    return strata, member_patient[kept], member_stratum[kept]
+
+
+def expand_to_strata(patient_codes, member_patient, member_stratum, nb_patients):
+    # Stratum of each (row, membership of its patient) pair, and the row it comes from
+    order = np.argsort(member_patient, kind="stable")
+    member_offsets = lengths_to_offsets(
+        np.bincount(member_patient, minlength=nb_patients)
+    )
+    repeats = np.diff(member_offsets)[patient_codes]
+    rows = np.repeat(np.arange(len(patient_codes)), repeats)
+    within = np.arange(len(rows)) - np.repeat(lengths_to_offsets(repeats)[:-1], repeats)
+    strata = member_stratum[order][member_offsets[patient_codes][rows] + within]
+    return rows, strata
+
+
+def segmented_statistics(keys, values):
+    # One sort by (group, value), then every statistic is a reduction over the
+    # contiguous segment of each group
+    order = np.lexsort((values, keys))
+    keys, values = keys[order], values[order]
+    boundaries = np.flatnonzero(keys[1:] != keys[:-1]) + 1
+    offsets = np.concatenate([[0], boundaries, [len(keys)]]).astype(np.int64)
+    if len(keys) == 0:
+        offsets = offsets[:1]
+    count = np.diff(offsets)
+    starts = offsets[:-1]
+
+    mean = segment_sum(values, offsets) / count
+    deviations = values - np.repeat(mean, count)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        std = np.where(
+            count > 1,
+            np.sqrt(segment_sum(deviations**2, offsets) / (count - 1)),
+            np.nan,
+        )
+    median = (values[starts + (count - 1) // 2] + values[starts + count // 2]) / 2
+    return keys[starts], {
+        "count": count,
+        "mean": mean,
+        "median": median,
+        "std": std,
+    }
+
+
+def get_stratified_metrics(formatted_data: pd.DataFrame, store: MetricsStore):
+    tools = list(store.categories["tool"]) + ["all"]
+    strata, member_patient, member_stratum = get_patient_strata(
+        formatted_data, store.categories["patient_id"]
+    )
+
+    # Every score also counts in the "all" tool rollup
+    valid = store.valid
+    codes = {column: store.codes[column][valid] for column in store.codes}
+    values = np.tile(store.value[valid], 2)
+    tool_codes = np.concatenate(
+        [codes["tool"], np.full(valid.sum(), len(tools) - 1, dtype=np.int32)]
+    )
+    rows, stratum_codes = expand_to_strata(
+        np.tile(codes["patient_id"], 2),
+        member_patient,
+        member_stratum,
+        len(store.categories["patient_id"]),
+    )
+
+    # Mixed-radix group key over (metric, criterium, tool, stratum)
+    sizes = [
+        len(store.categories["metric_name"]),
+        len(store.categories["criterium"]),
+        len(tools),
+        len(strata),
+    ]
+    key_columns = [
+        np.tile(codes["metric_name"], 2)[rows],
+        np.tile(codes["criterium"], 2)[rows],
+        tool_codes[rows],
+        stratum_codes,
+    ]
+    keys = np.zeros(len(rows), dtype=np.int64)
+    for column, size in zip(key_columns, sizes):
+        keys = keys * size + column
+
+    group_keys, statistics = segmented_statistics(keys, values[rows])
+    group_codes = np.unravel_index(group_keys, sizes)
+
+    return pd.DataFrame(
+        {
+            "metric_name": store.categories["metric_name"][group_codes[0]],
+            "criterium": store.categories["criterium"][group_codes[1]],
+            "tool": np.asarray(tools, dtype=str)[group_codes[2]],
+            "stratum_type": strata["stratum_type"].to_numpy()[group_codes[3]],
+            "stratum": strata["stratum"].to_numpy()[group_codes[3]],
+            **statistics,
+        }
+    )
+
+
+def main(formatted_data: pd.DataFrame, df_metrics: pd.DataFrame):
+    df_stratified = get_stratified_metrics(
+        formatted_data, MetricsStore.from_frame(df_metrics)
+    )
+    df_stratified.to_csv(STRATIFIED_METRICS_PATH, index=False)
+    return df_stratified
+
+
+if __name__ == "__main__":
+    formatted_data = get_formatted_data(FORMATTED_CSV_PATH)
+    df_metrics = MetricsStore.load(METRICS_STORE_PATH).to_frame()
+    main(formatted_data, df_metrics)
@@ -0,0 +1,41 @@
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+
+@dataclass(frozen=True)
+class TrialDictionary:
+    # Interned NCT IDs, the int32 code of a trial being its position in nct_ids
+    nct_ids: pd.Index
+
+    @staticmethod
+    def from_nct_ids(nct_ids):
+        # Codes follow the order of first appearance, so the same formatted_data
+        # always gives the same codes
+        codes, unique_nct_ids = pd.factorize(np.asarray(nct_ids, dtype=object))
+        return TrialDictionary(pd.Index(unique_nct_ids)), codes.astype(np.int32)
+
+    def __len__(self):
+        return len(self.nct_ids)
+
+    def encode(self, nct_ids) -> np.ndarray:
+        # -1 for NCT IDs that are not in the dictionary
+        return self.nct_ids.get_indexer(nct_ids).astype(np.int32)
+
+    def decode(self, codes) -> np.ndarray:
+        return self.nct_ids.to_numpy(dtype=str)[codes]
+
+    def mask(self, nct_ids) -> np.ndarray:
+        # Bitset over the codes of the given NCT IDs
+        codes = self.encode(nct_ids)
+        mask = np.zeros(len(self), dtype=bool)
+        mask[codes[codes >= 0]] = True
+        return mask
+
+    def positions(self, nct_ids) -> np.ndarray:
+        # Position of each code in nct_ids, -1 for codes not in nct_ids
+        codes = self.encode(nct_ids)
+        positions = np.full(len(self), -1, dtype=np.int64)
+        positions[codes[codes >= 0]] = np.flatnonzero(codes >= 0)
+        return positions
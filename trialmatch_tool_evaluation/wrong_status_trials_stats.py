@@ -1,6 +1,8 @@
+import numpy as np
 import pandas as pd
 
 from trialmatch_tool_evaluation import FORMATTED_CSV_PATH, PLOTS_FOLDER
+from trialmatch_tool_evaluation.cohort import Cohort
 from trialmatch_tool_evaluation.preprocess_files import get_formatted_data
 
 FP_trials = [
@@ -31,29 +33,24 @@ FN_trials = [
 ]
 
 
-def append_dict(dict_object, nct, patient):
-    dict_object["nct"].append(nct)
-    dict_object["patient"].append(patient)
-    return dict_object
+def find_watched_trials(cohort: Cohort, watchlist):
+    # (nct, patient) for each watched trial found in a patient's trials, patient by
+    # patient and in watchlist order
+    positions = cohort.trials.positions(watchlist)[cohort.nct_code]
+    found = positions >= 0
+    pairs = np.unique(cohort.segment_ids[found] * len(watchlist) + positions[found])
+    patients, watched = np.divmod(pairs, len(watchlist))
+    return {
+        "nct": np.asarray(watchlist, dtype=object)[watched],
+        "patient": cohort.patient_id[patients],
+    }
 
 
 def main(formatted_data: pd.DataFrame):
 
-    FP_trials_data = {"nct": [], "patient": []}
-    FN_trials_data = {"nct": [], "patient": []}
-
-    for _, patient_row in formatted_data.iterrows():
-        patient_id = patient_row["patient_id"]
-        patient_trials = patient_row["nct_id"]
-        for nct in FP_trials:
-            if nct in patient_trials:
-                append_dict(FP_trials_data, nct, patient_id)
-        for nct in FN_trials:
-            if nct in patient_trials:
-                append_dict(FN_trials_data, nct, patient_id)
-
-    FP_trials_df = pd.DataFrame(FP_trials_data)
-    FN_trials_df = pd.DataFrame(FN_trials_data)
+    cohort = Cohort.from_formatted_data(formatted_data)
+    FP_trials_df = pd.DataFrame(find_watched_trials(cohort, FP_trials))
+    FN_trials_df = pd.DataFrame(find_watched_trials(cohort, FN_trials))
 
     FP_trials_df = FP_trials_df.sort_values(by="nct").reset_index(drop=True)
     FN_trials_df = FN_trials_df.sort_values(by="nct").reset_index(drop=True)